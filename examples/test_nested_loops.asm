@@ -0,0 +1,20 @@
+; Nested loops inside a function that makes calls
+; The parameter is kept in r12, so each loop counter must get its own
+; callee-saved register (r13 for i, r14 for j) instead of sharing one
+
+section .text
+    global main
+    extern ExitProcess
+
+func show(count)
+    for i = 0, 2
+        for j = 0, 2
+            call println j
+        endfor
+        call println i
+    endfor
+endfunc
+
+main:
+    call show(3)
+    call ExitProcess(0)
@@ -1,15 +1,47 @@
+import io
 from abc import ABC, abstractmethod
 
 class Backend(ABC):
+    # Directive that opens the code section
+    TEXT_SECTION = 'section .text'
+
     def __init__(self, target='windows', bits=64):
         self.target = target
         self.bits = bits
-        self.output = []
+        # Generated code is streamed into a single text buffer rather than
+        # collected as a list of line strings and joined at the end.
+        self.output = io.StringIO()
+        self._line_sep = ''
         self.data_section = []
         self.label_counter = 0
 
+    def _write_line(self, line):
+        out = self.output
+        out.write(self._line_sep)
+        out.write(line)
+        self._line_sep = '\n'
+
     def get_output(self):
-        return self.output
+        """Return the generated code as newline-separated text."""
+        return self.output.getvalue()
+
+    def mark(self):
+        """Return a position in the output that discard() can rewind to."""
+        return self.output.tell()
+
+    def text_since(self, mark):
+        """Return the text emitted since mark."""
+        # settle output the backend is still holding back
+        self.mark()
+        self.output.seek(mark)
+        return self.output.read()
+
+    def discard(self, mark):
+        """Drop everything emitted since mark."""
+        self.output.seek(mark)
+        self.output.truncate()
+        if not mark:
+            self._line_sep = ''
 
     def get_data_section(self):
         return self.data_section
@@ -51,6 +83,10 @@ class Backend(ABC):
     def ret(self):
         pass
 
+    def set_return_value(self):
+        """Hook run before a return branches to the function epilogue."""
+        pass
+
     @abstractmethod
     def label(self, name):
         pass
@@ -66,6 +102,11 @@ class Backend(ABC):
     @abstractmethod
     def cond_jump(self, condition, label):
         pass
+
+    @abstractmethod
+    def count_down_jump(self, reg, label):
+        """Decrement reg and jump to label while it is non-zero"""
+        pass
     
     @abstractmethod
     def push(self, reg):
@@ -74,6 +115,16 @@ class Backend(ABC):
     @abstractmethod
     def pop(self, reg):
         pass
+
+    @abstractmethod
+    def save_registers(self, regs):
+        """Preserve callee-saved regs after the frame is set up"""
+        pass
+
+    @abstractmethod
+    def restore_registers(self, regs):
+        """Undo save_registers(regs) ahead of the epilogue"""
+        pass
     
     @abstractmethod
     def emit_raw(self, line):
@@ -110,9 +161,26 @@ class Backend(ABC):
         pass
 
 
+# Backslash and double quote escapes for .asciz string bodies
+_ASCIZ_TABLE = str.maketrans({'\\': '\\\\', '"': '\\"'})
+
+
+# Frame setup/teardown sequences, indexed by `bits == 64`
+_X86_FRAME_ENTER = (
+    '    push ebp\n    mov ebp, esp',
+    '    push rbp\n    mov rbp, rsp',
+)
+_X86_FRAME_LEAVE = (
+    '    pop ebp\n    ret',
+    '    pop rbp\n    ret',
+)
+
+
 class X86Backend(Backend):
     def __init__(self, target='windows', bits=64):
         super().__init__(target, bits)
+        # bytes of pushed call arguments not yet popped with `add esp, N`
+        self._pending_stack_release = 0
         self.register_map = {}
         # Calling convention registers
         if self.target == 'windows':
@@ -122,52 +190,82 @@ class X86Backend(Backend):
             self.arg_regs = ['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
 
     def emit_raw(self, line):
-        self.output.append(line)
+        self._flush_stack_release()
+        self._write_line(line)
+
+    def push_arg(self, operand):
+        """Push one cdecl call argument.
+
+        Unlike emit_raw this leaves a pending release outstanding, so the
+        arguments of the next call can be pushed before the last call's are
+        popped. Operands addressed off esp settle it first.
+        """
+        if 'esp' in operand:
+            self._flush_stack_release()
+        self._write_line(f"    push {operand}")
+
+    def get_output(self):
+        self._flush_stack_release()
+        return super().get_output()
+
+    def mark(self):
+        # settle argument cleanup owed by code before the mark
+        self._flush_stack_release()
+        return super().mark()
+
+    def discard(self, mark):
+        self._pending_stack_release = 0
+        super().discard(mark)
+
+    def release_stack(self, nbytes):
+        """Pop nbytes of cdecl call arguments.
+
+        The `add esp, N` is deferred so back-to-back push/call sequences
+        share a single stack adjustment; only push_arg and call_function
+        carry it forward, any other line (raw user code included) writes it
+        out first.
+        """
+        self._pending_stack_release += nbytes
+
+    def _flush_stack_release(self):
+        if self._pending_stack_release:
+            nbytes = self._pending_stack_release
+            self._pending_stack_release = 0
+            self._write_line(f"    add esp, {nbytes}")
 
     def label(self, name):
-        self.output.append(f"{name}:")
+        self.emit_raw(f"{name}:")
 
     def prologue(self, name, params):
-        self.output.append(f"\nglobal {name}")
-        self.output.append(f"{name}:")
-        if self.bits == 64:
-            self.output.append("    push rbp")
-            self.output.append("    mov rbp, rsp")
-        else:
-            self.output.append("    push ebp")
-            self.output.append("    mov ebp, esp")
+        self.emit_raw(f"\nglobal {name}\n{name}:\n{_X86_FRAME_ENTER[self.bits == 64]}")
 
     def epilogue(self):
-        if self.bits == 64:
-            self.output.append("    pop rbp")
-        else:
-            self.output.append("    pop ebp")
-        self.output.append("    ret")
+        self.emit_raw(_X86_FRAME_LEAVE[self.bits == 64])
 
     def mov(self, dest, src):
-        self.output.append(f"    mov {dest}, {src}")
+        self.emit_raw(f"    mov {dest}, {src}")
 
     def add(self, dest, src):
-        self.output.append(f"    add {dest}, {src}")
+        self.emit_raw(f"    add {dest}, {src}")
 
     def sub(self, dest, src):
-        self.output.append(f"    sub {dest}, {src}")
+        self.emit_raw(f"    sub {dest}, {src}")
         
     def mul(self, dest, src):
         # x86 imul is complex, simplified for now
-        self.output.append(f"    imul {dest}, {src}")
+        self.emit_raw(f"    imul {dest}, {src}")
 
     def call(self, name):
-        self.output.append(f"    call {name}")
+        self.emit_raw(f"    call {name}")
 
     def ret(self):
         self.epilogue()
 
     def jump(self, label):
-        self.output.append(f"    jmp {label}")
+        self.emit_raw(f"    jmp {label}")
 
     def compare(self, op1, op2):
-        self.output.append(f"    cmp {op1}, {op2}")
+        self.emit_raw(f"    cmp {op1}, {op2}")
 
     def cond_jump(self, condition, label):
         # condition map: 'eq' -> 'je', 'ne' -> 'jne', etc.
@@ -177,13 +275,30 @@ class X86Backend(Backend):
             '>': 'jg', '>=': 'jge'
         }
         asm_op = cond_map.get(condition, 'jmp')
-        self.output.append(f"    {asm_op} {label}")
+        self.emit_raw(f"    {asm_op} {label}")
+
+    def count_down_jump(self, reg, label):
+        self.emit_raw(f"    dec {reg}")
+        self.emit_raw(f"    jnz {label}")
         
     def push(self, reg):
-        self.output.append(f"    push {reg}")
+        self.emit_raw(f"    push {reg}")
         
     def pop(self, reg):
-        self.output.append(f"    pop {reg}")
+        self.emit_raw(f"    pop {reg}")
+
+    def save_registers(self, regs):
+        for reg in regs:
+            self.push(reg)
+        # keep rsp 16-byte aligned for calls made from the body
+        if self.bits == 64 and len(regs) % 2:
+            self.emit_raw("    sub rsp, 8")
+
+    def restore_registers(self, regs):
+        if self.bits == 64 and len(regs) % 2:
+            self.emit_raw("    add rsp, 8")
+        for reg in reversed(regs):
+            self.pop(reg)
     
     def emit_string_data(self, label, string_value):
         """Emit NASM-style string data"""
@@ -191,98 +306,103 @@ class X86Backend(Backend):
     
     def load_address(self, dest_reg, label):
         """Load effective address (LEA) for x86-64"""
-        self.output.append(f"    lea {dest_reg}, [rel {label}]")
+        self.emit_raw(f"    lea {dest_reg}, [rel {label}]")
     
     def load_effective_address(self, dest_reg, operand):
         """Load effective address from an operand (memory or identifier)"""
         # If operand is already a memory reference like [rsp + 512], use it directly
         if operand.startswith('['):
-            self.output.append(f"    lea {dest_reg}, {operand}")
+            self.emit_raw(f"    lea {dest_reg}, {operand}")
         else:
             # If it's an identifier, wrap it in brackets
-            self.output.append(f"    lea {dest_reg}, [{operand}]")
+            self.emit_raw(f"    lea {dest_reg}, [{operand}]")
     
     def call_function(self, name):
         """Call a function (x86-64)"""
-        self.output.append(f"    call {name}")
+        # a generated call may run before earlier pushed arguments are popped
+        self._write_line(f"    call {name}")
     
     def emit_extern(self, name):
         """Emit NASM extern declaration"""
-        self.output.append(f"extern {name}")
+        self.emit_raw(f"extern {name}")
     
     def emit_data_section(self):
         """Emit NASM data section"""
-        self.output.append("section .data")
+        self.emit_raw("section .data")
     
     def emit_text_section(self):
         """Emit NASM text section"""
-        self.output.append("section .text")
+        self.emit_raw(self.TEXT_SECTION)
+
+
+_ARM64_FRAME_ENTER = '    stp x29, x30, [sp, #-16]!\n    mov x29, sp'
+_ARM64_FRAME_LEAVE = '    ldp x29, x30, [sp], #16\n    ret'
 
 
 class ARM64Backend(Backend):
+    TEXT_SECTION = '.text'
+
     def __init__(self, target='macos', bits=64):
         super().__init__(target, bits)
         # ARM64 registers: x0-x7 are args
         self.arg_regs = [f'x{i}' for i in range(8)]
 
-    def emit_raw(self, line):
-        self.output.append(line)
+    # nothing is held back on ARM64, so raw lines go straight to the buffer
+    emit_raw = Backend._write_line
 
     def label(self, name):
-        self.output.append(f"{name}:")
+        self.emit_raw(f"{name}:")
 
     def prologue(self, name, params):
-        self.output.append(f"\n.global _{name}")
-        self.output.append(f".align 2")
-        self.output.append(f"_{name}:")
         # Standard frame: stp fp, lr, [sp, #-16]!
         # fp = x29, lr = x30
-        self.output.append("    stp x29, x30, [sp, #-16]!")
-        self.output.append("    mov x29, sp")
+        self.emit_raw(f"\n.global _{name}\n.align 2\n_{name}:\n{_ARM64_FRAME_ENTER}")
 
     def epilogue(self):
-        self.output.append("    ldp x29, x30, [sp], #16")
-        self.output.append("    ret")
+        self.emit_raw(_ARM64_FRAME_LEAVE)
 
     def mov(self, dest, src):
         # ARM64 mov is 'mov x0, x1' or 'mov x0, #10'
         if str(src).isdigit():
-            self.output.append(f"    mov {dest}, #{src}")
+            self.emit_raw(f"    mov {dest}, #{src}")
         else:
-            self.output.append(f"    mov {dest}, {src}")
+            self.emit_raw(f"    mov {dest}, {src}")
 
     def add(self, dest, src):
         if str(src).isdigit():
-            self.output.append(f"    add {dest}, {dest}, #{src}")
+            self.emit_raw(f"    add {dest}, {dest}, #{src}")
         else:
-            self.output.append(f"    add {dest}, {dest}, {src}")
+            self.emit_raw(f"    add {dest}, {dest}, {src}")
 
     def sub(self, dest, src):
         if str(src).isdigit():
-            self.output.append(f"    sub {dest}, {dest}, #{src}")
+            self.emit_raw(f"    sub {dest}, {dest}, #{src}")
         else:
-            self.output.append(f"    sub {dest}, {dest}, {src}")
+            self.emit_raw(f"    sub {dest}, {dest}, {src}")
             
     def mul(self, dest, src):
-        self.output.append(f"    mul {dest}, {dest}, {src}")
+        self.emit_raw(f"    mul {dest}, {dest}, {src}")
 
     def call(self, name):
         # macOS expects underscore prefix for C functions
-        self.output.append(f"    bl _{name}")
+        self.emit_raw(f"    bl _{name}")
 
     def ret(self):
-        # Set return value to 0 for main function
-        self.output.append("    mov x0, #0")
+        self.set_return_value()
         self.epilogue()
 
+    def set_return_value(self):
+        # Set return value to 0 for main function
+        self.emit_raw("    mov x0, #0")
+
     def jump(self, label):
-        self.output.append(f"    b {label}")
+        self.emit_raw(f"    b {label}")
 
     def compare(self, op1, op2):
         if str(op2).isdigit():
-            self.output.append(f"    cmp {op1}, #{op2}")
+            self.emit_raw(f"    cmp {op1}, #{op2}")
         else:
-            self.output.append(f"    cmp {op1}, {op2}")
+            self.emit_raw(f"    cmp {op1}, {op2}")
 
     def cond_jump(self, condition, label):
         # condition map: '==' -> 'b.eq', etc.
@@ -292,27 +412,43 @@ class ARM64Backend(Backend):
             '>': 'b.gt', '>=': 'b.ge'
         }
         asm_op = cond_map.get(condition, 'b')
-        self.output.append(f"    {asm_op} {label}")
+        self.emit_raw(f"    {asm_op} {label}")
+
+    def count_down_jump(self, reg, label):
+        self.emit_raw(f"    subs {reg}, {reg}, #1")
+        self.emit_raw(f"    b.ne {label}")
         
     def push(self, reg):
         # ARM64 push is str reg, [sp, #-16]! (16-byte aligned)
-        self.output.append(f"    str {reg}, [sp, #-16]!")
+        self.emit_raw(f"    str {reg}, [sp, #-16]!")
 
     def pop(self, reg):
-        self.output.append(f"    ldr {reg}, [sp], #16")
+        self.emit_raw(f"    ldr {reg}, [sp], #16")
+
+    def save_registers(self, regs):
+        for i in range(0, len(regs) - 1, 2):
+            self.emit_raw(f"    stp {regs[i]}, {regs[i + 1]}, [sp, #-16]!")
+        if len(regs) % 2:
+            self.push(regs[-1])
+
+    def restore_registers(self, regs):
+        if len(regs) % 2:
+            self.pop(regs[-1])
+        for i in range(len(regs) - (len(regs) % 2) - 2, -1, -2):
+            self.emit_raw(f"    ldp {regs[i]}, {regs[i + 1]}, [sp], #16")
     
     def emit_string_data(self, label, string_value):
         """Emit ARM64-style string data"""
         # ARM64 uses .asciz directive
         # Need to escape the string properly for ARM64 assembly
-        escaped = string_value.replace('\\', '\\\\').replace('"', '\\"')
+        escaped = string_value.translate(_ASCIZ_TABLE)
         self.data_section.append(f"{label}: .asciz \"{escaped}\"")
     
     def load_address(self, dest_reg, label):
         """Load address using ADRP + ADD for ARM64"""
         # ARM64 uses page-relative addressing
-        self.output.append(f"    adrp {dest_reg}, {label}@PAGE")
-        self.output.append(f"    add {dest_reg}, {dest_reg}, {label}@PAGEOFF")
+        self.emit_raw(f"    adrp {dest_reg}, {label}@PAGE")
+        self.emit_raw(f"    add {dest_reg}, {dest_reg}, {label}@PAGEOFF")
     
     def load_effective_address(self, dest_reg, operand):
         """Load effective address from an operand (memory or identifier)"""
@@ -320,31 +456,31 @@ class ARM64Backend(Backend):
         if operand.startswith('['):
             # Extract the address calculation from brackets
             # For now, emit a comment and use adr for simple cases
-            self.output.append(f"    ; LEA equivalent for {operand}")
+            self.emit_raw(f"    ; LEA equivalent for {operand}")
             # This is a simplified implementation - full support would need
             # proper parsing of the memory operand
-            self.output.append(f"    adr {dest_reg}, {operand}")
+            self.emit_raw(f"    adr {dest_reg}, {operand}")
         else:
             # Use adrp + add for identifiers
-            self.output.append(f"    adrp {dest_reg}, {operand}@PAGE")
-            self.output.append(f"    add {dest_reg}, {dest_reg}, {operand}@PAGEOFF")
+            self.emit_raw(f"    adrp {dest_reg}, {operand}@PAGE")
+            self.emit_raw(f"    add {dest_reg}, {dest_reg}, {operand}@PAGEOFF")
     
     def call_function(self, name):
         """Call a function (ARM64) - macOS requires underscore prefix"""
         if name.startswith('_'):
-            self.output.append(f"    bl {name}")
+            self.emit_raw(f"    bl {name}")
         else:
-            self.output.append(f"    bl _{name}")
+            self.emit_raw(f"    bl _{name}")
     
     def emit_extern(self, name):
         """Emit ARM64 extern declaration (GAS syntax)"""
         # ARM64 on macOS uses .extern with underscore prefix
-        self.output.append(f".extern _{name}")
+        self.emit_raw(f".extern _{name}")
     
     def emit_data_section(self):
         """Emit ARM64 data section (GAS syntax)"""
-        self.output.append(".data")
+        self.emit_raw(".data")
     
     def emit_text_section(self):
         """Emit ARM64 text section (GAS syntax)"""
-        self.output.append(".text")
+        self.emit_raw(self.TEXT_SECTION)
@@ -1,31 +1,571 @@
+import operator
+import re
+from collections import namedtuple
+from functools import partial
+from itertools import count
+
 from src.token import TokenType, Token
 from src.backend import X86Backend, ARM64Backend
 
+# Stdlib helpers that share the generic register/stack argument marshalling
+# in generate_stdlib_call.
+_STDLIB_FUNCS = frozenset((
+    'strlen', 'strcpy', 'strcmp', 'strcat', 'abs', 'min', 'max', 'pow',
+    'arraysum', 'arrayfill', 'arraycopy', 'memset', 'memcpy', 'rand', 'sleep',
+))
+
+
+# String literal escapers applied when the data section is finalized. NASM
+# backtick strings interpret C-style escapes, so backticks must be escaped and
+# control characters written back out as escape sequences. Single-character
+# substitutions go through str.translate tables so each literal is scanned
+# once.
+_BACKTICK_TABLE = str.maketrans({'`': '\\`'})
+_NASM_TABLE = str.maketrans({'`': '\\`', '\n': '\\n', '\r': '\\r'})
+_NASM_PRINT_TABLE = str.maketrans({'`': '\\`', '\n': '\\\\n', '\r': '\\\\r'})
+
+
+# Jump targets for 'break' / 'continue' inside the innermost loop
+_LoopFrame = namedtuple('_LoopFrame', 'break_label continue_label')
+
+# Token types that terminate the body of each high-level block
+_IF_BRANCH_TOKENS = frozenset((TokenType.ELIF, TokenType.ELSE))
+_IF_BODY_END = _IF_BRANCH_TOKENS | {TokenType.ENDIF}
+_ELSE_BODY_END = frozenset((TokenType.ENDIF,))
+_FOR_BODY_END = frozenset((TokenType.ENDFOR,))
+_WHILE_BODY_END = frozenset((TokenType.ENDWHILE,))
+_FUNC_BODY_END = frozenset((TokenType.ENDFUNC,))
+
+# Token types accepted as call arguments
+_NAME_TOKENS = frozenset((TokenType.REGISTER, TokenType.IDENTIFIER))
+_SCALAR_ARG_TOKENS = _NAME_TOKENS | {TokenType.NUMBER}
+_BARE_ARG_TOKENS = _SCALAR_ARG_TOKENS | {TokenType.STRING}
+_OPERAND_ARG_TOKENS = _SCALAR_ARG_TOKENS | {TokenType.LBRACKET}
+# Top-level tokens generate() steps over without emitting anything
+_PASSTHROUGH_TOKENS = frozenset((TokenType.NEWLINE, TokenType.ASM_LINE))
+
+# Inverted branch condition (jump taken when the comparison is false) and
+# compile-time evaluator for each comparison operator.
+_JUMP_MAP = {
+    TokenType.EQ: '!=', TokenType.NE: '==',
+    TokenType.LT: '>=', TokenType.GT: '<=',
+    TokenType.LE: '>', TokenType.GE: '<',
+}
+_CMP_OPS = frozenset(_JUMP_MAP)
+# Operators accepted by the comparison form of `for`
+_ORDER_CMP_OPS = frozenset((TokenType.LT, TokenType.LE, TokenType.GT, TokenType.GE))
+_CONST_CMP = {
+    TokenType.EQ: operator.eq, TokenType.NE: operator.ne,
+    TokenType.LT: operator.lt, TokenType.GT: operator.gt,
+    TokenType.LE: operator.le, TokenType.GE: operator.ge,
+}
+
+def _reg_aliases(reg):
+    """Names of every view of reg's architectural register (r12/r12d/...)."""
+    reg = reg.lower()
+    if reg[0] in 'xw' and reg[1:].isdigit():
+        return {'x' + reg[1:], 'w' + reg[1:]}
+    if reg[0] == 'r' and reg[1:2].isdigit():
+        num = reg[1:].rstrip('dwb')
+        return {f"r{num}{suffix}" for suffix in ('', 'd', 'w', 'b')}
+    base = reg[1:] if len(reg) == 3 and reg[0] in 're' else reg
+    names = {base, 'e' + base, 'r' + base}
+    if base.endswith('x'):
+        names.update((base[0] + 'l', base[0] + 'h'))
+    else:
+        names.add(base + 'l')
+    return names
+
+
+def _mentions_any(text, names):
+    """Whether any of names occurs as a whole word in text."""
+    pattern = r'\b(?:' + '|'.join(map(re.escape, names)) + r')\b'
+    return re.search(pattern, text, re.IGNORECASE) is not None
+
+
+_LABEL_LINE_RE = re.compile(r'([A-Za-z_.$?@][\w.$?@]*):$')
+_LOCAL_LABEL_RE = re.compile(r'\.L\d+$')
+_LOCAL_REF_RE = re.compile(r'\.L\d+\b')
+_JUMP_LINE_RE = re.compile(r'(j[a-z]+|b(?:\.[a-z]+)?) +(\.L\d+)$')
+_UNCONDITIONAL_JUMPS = frozenset(('jmp', 'b'))
+
+# Line classes used by _peephole
+_SKIP, _LABEL, _JUMP, _OTHER, _DEAD = range(5)
+
+
+_GPR64 = frozenset((
+    'rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp',
+    'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15',
+))
+_MOV_REG_RE = re.compile(r'mov\s+(\w+),\s*(\w+)$', re.IGNORECASE)
+_SHL_ADD_RE = re.compile(r'(shl|add)\s+(\w+),\s*(-?\w+)$', re.IGNORECASE)
+_IMM32_RE = re.compile(r'-?\d{1,9}$')
+_MOV_ZERO_RE = re.compile(r'mov\s+(\w+),\s*0$', re.IGNORECASE)
+_CMP_ZERO_RE = re.compile(r'cmp\s+(\w+),\s*0$', re.IGNORECASE)
+# Instructions that leave the flags alone / overwrite every status flag
+_FLAGS_PRESERVED = frozenset(('mov', 'lea', 'push', 'pop', 'nop', 'movzx', 'movsx', 'movsxd'))
+_FLAGS_WRITTEN = frozenset(('cmp', 'test', 'add', 'sub', 'and', 'or', 'xor', 'neg'))
+
+# Appended to the raw asm lines emitted inside generated blocks so that
+# _peephole can tell them from generated code; _peephole strips it again
+_ASM_LINE_TAG = ' ; __ASM__'
+
+
+def _flags_dead_after(lines, kinds, user, i):
+    """Whether the flags set by line i are overwritten before any read.
+
+    A ret, and any call or syscall from raw asm, counts as a read: hand
+    written code may pass results in the flags. A generated call follows
+    the C calling convention, where the flags carry nothing.
+    """
+    for j in range(i + 1, len(lines)):
+        kind = kinds[j]
+        if kind in (_SKIP, _LABEL, _DEAD):
+            continue
+        if kind != _OTHER:
+            return False
+        s = lines[j].strip()
+        if s[0] == ';':
+            # block boundary: user code follows
+            return False
+        op = s.split(None, 1)[0].lower()
+        if op in _FLAGS_WRITTEN or (op == 'call' and not user[j]):
+            return True
+        if op not in _FLAGS_PRESERVED:
+            return False
+    return False
+
+
+def _fuse_lea(lines, kinds, user):
+    """Rewrite `mov A, B` + `shl A, 1..3` / `add A, C` as a single lea.
+
+    Only generated pairs of full-width x86-64 registers are fused, and
+    only when the flags the shl/add would have produced are never read.
+    """
+    n = len(lines)
+    for i in range(n):
+        if kinds[i] != _OTHER or user[i]:
+            continue
+        m = _MOV_REG_RE.match(lines[i].strip())
+        if not m:
+            continue
+        dest, src = m.group(1).lower(), m.group(2).lower()
+        if dest == src or dest not in _GPR64 or src not in _GPR64:
+            continue
+        j = i + 1
+        while j < n and kinds[j] == _SKIP:
+            j += 1
+        if j == n or kinds[j] != _OTHER or user[j]:
+            continue
+        m = _SHL_ADD_RE.match(lines[j].strip())
+        if not m or m.group(2).lower() != dest:
+            continue
+        op, operand = m.group(1).lower(), m.group(3).lower()
+        if op == 'shl':
+            if operand not in ('1', '2', '3'):
+                continue
+            address = f"{src}+{src}" if operand == '1' else f"{src}*{1 << int(operand)}"
+        else:
+            if operand == dest:
+                operand = src
+            if operand in _GPR64:
+                address = f"{src}+{operand}"
+            elif _IMM32_RE.match(operand):
+                address = f"{src}-{operand[1:]}" if operand[0] == '-' else f"{src}+{operand}"
+            else:
+                continue
+        if not _flags_dead_after(lines, kinds, user, j):
+            continue
+        ln = lines[i]
+        lines[i] = f"{ln[:len(ln) - len(ln.lstrip())]}lea {dest}, [{address}]"
+        kinds[j] = _DEAD
+
+
+def _zero_with_xor(lines, kinds, user):
+    """Rewrite a generated `mov reg, 0` as `xor reg32, reg32` where the
+    flags the xor writes are never read."""
+    for i, ln in enumerate(lines):
+        if kinds[i] != _OTHER or user[i]:
+            continue
+        m = _MOV_ZERO_RE.match(ln.strip())
+        if not m:
+            continue
+        dest = m.group(1).lower()
+        reg32 = _X86_SUBREG32.get(dest)
+        if reg32 is None:
+            if dest in _X86_LEGACY32 or (dest[0] == 'r' and dest[-1] == 'd' and dest[1:-1].isdigit()):
+                reg32 = dest
+            else:
+                continue
+        if not _flags_dead_after(lines, kinds, user, i):
+            continue
+        lines[i] = f"{ln[:len(ln) - len(ln.lstrip())]}xor {reg32}, {reg32}"
+
+
+def _test_for_cmp_zero(lines, kinds, user):
+    """Rewrite a generated `cmp reg, 0` as the shorter `test reg, reg`.
+
+    Both leave CF and OF clear and set ZF, SF and PF from reg, so the
+    flags a later branch reads are unchanged.
+    """
+    for i, ln in enumerate(lines):
+        if kinds[i] != _OTHER or user[i]:
+            continue
+        m = _CMP_ZERO_RE.match(ln.strip())
+        if not m:
+            continue
+        reg = m.group(1)
+        low = reg.lower()
+        if low not in _X86_SUBREG32 and low not in _X86_LEGACY32 and not (
+                low[0] == 'r' and low[-1] == 'd' and low[1:-1].isdigit()):
+            continue
+        lines[i] = f"{ln[:len(ln) - len(ln.lstrip())]}test {reg}, {reg}"
+
+
+def _peephole(text, x86=False):
+    """Tidy the branch structure of generated code.
+
+    - runs of labels at the same address collapse onto one label;
+    - a jump to a label that only jumps on is retargeted to the final
+      destination;
+    - a jump straight to the label that follows it is dropped;
+    - jumps and rets behind an unconditional jump or ret are dropped;
+    - generated `.L` labels that end up unreferenced are dropped;
+    - on x86, mov+shl/add pairs become one lea (see _fuse_lea),
+      `mov reg, 0` becomes a xor when the flags are dead and `cmp reg, 0`
+      becomes `test reg, reg`.
+
+    User code is spliced in between top-level generated blocks, so those
+    block boundaries act as barriers: lines on either side of one are not
+    adjacent in the final program. Raw asm lines inside a block (tagged
+    with _ASM_LINE_TAG) are never rewritten.
+    """
+    lines = text.split('\n')
+    n = len(lines)
+    kinds = [_OTHER] * n
+    args = [None] * n
+    user = [False] * n
+    depth = 0
+    for i, ln in enumerate(lines):
+        if ln.endswith(_ASM_LINE_TAG):
+            ln = lines[i] = ln[:-len(_ASM_LINE_TAG)]
+            user[i] = True
+        s = ln.strip()
+        if not s or s[0] == ';':
+            if s.startswith('; __GEN_START__'):
+                depth += 1
+                if depth == 1:
+                    continue
+            elif s.startswith('; __GEN_END__'):
+                depth -= 1
+                if depth <= 0:
+                    depth = 0
+                    continue
+            kinds[i] = _SKIP
+            continue
+        m = _LABEL_LINE_RE.match(s)
+        if m:
+            kinds[i] = _LABEL
+            args[i] = m.group(1)
+            continue
+        m = _JUMP_LINE_RE.match(s)
+        if m:
+            kinds[i] = _JUMP
+            args[i] = m.groups()
+
+    if x86:
+        _fuse_lea(lines, kinds, user)
+        _zero_with_xor(lines, kinds, user)
+        _test_for_cmp_zero(lines, kinds, user)
+
+    # Merge runs of labels, keeping a user label when the run has one
+    alias = {}
+    run = []
+    for i in range(n + 1):
+        kind = kinds[i] if i < n else _OTHER
+        if kind == _LABEL:
+            run.append(i)
+            continue
+        if kind == _SKIP:
+            continue
+        if len(run) > 1:
+            names = [args[j] for j in run]
+            keep = next((name for name in names if not _LOCAL_LABEL_RE.match(name)), names[0])
+            for j in run:
+                if args[j] != keep and _LOCAL_LABEL_RE.match(args[j]):
+                    alias[args[j]] = keep
+                    kinds[j] = _DEAD
+        run = []
+
+    label_at = {}
+    next_real = [n] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        kind = kinds[i]
+        if kind == _LABEL:
+            label_at[args[i]] = i
+        next_real[i] = i if kind in (_JUMP, _OTHER) else next_real[i + 1]
+
+    def final_target(target):
+        seen = set()
+        while target not in seen:
+            seen.add(target)
+            j = label_at.get(target)
+            if j is None:
+                break
+            k = next_real[j]
+            if k == n or kinds[k] != _JUMP or args[k][0] not in _UNCONDITIONAL_JUMPS:
+                break
+            target = alias.get(args[k][1], args[k][1])
+        return target
+
+    for i in range(n):
+        if kinds[i] != _JUMP:
+            continue
+        op, target = args[i]
+        new_target = final_target(alias.get(target, target))
+        if new_target != target:
+            ln = lines[i]
+            lines[i] = ln[:ln.rindex(target)] + new_target
+            args[i] = (op, new_target)
+
+    # Dropping one jump can expose another (a jump left in front of its
+    # own target, or a label that no longer hides dead code), so repeat
+    # until nothing changes.
+    while True:
+        referenced = set()
+        for i, ln in enumerate(lines):
+            if kinds[i] not in (_LABEL, _DEAD) and '.L' in ln:
+                referenced.update(_LOCAL_REF_RE.findall(ln))
+        changed = False
+
+        # Jumps and rets straight behind an unconditional jump or a ret
+        # are unreachable until the next live label (e.g. an else-skip
+        # after a break)
+        dead_tail = False
+        for i in range(n):
+            kind = kinds[i]
+            if kind in (_SKIP, _DEAD):
+                continue
+            if kind == _LABEL:
+                if args[i] in referenced or not _LOCAL_LABEL_RE.match(args[i]):
+                    dead_tail = False
+                continue
+            is_ret = kind == _OTHER and lines[i].strip() == 'ret'
+            if dead_tail and (kind == _JUMP or is_ret):
+                kinds[i] = _DEAD
+                changed = True
+                continue
+            dead_tail = is_ret or (kind == _JUMP and args[i][0] in _UNCONDITIONAL_JUMPS)
+
+        # drop a jump that lands on the very next instruction
+        following = n
+        for i in range(n - 1, -1, -1):
+            kind = kinds[i]
+            if kind == _JUMP:
+                j = i + 1
+                while j < following:
+                    if kinds[j] == _LABEL and args[j] == args[i][1]:
+                        kinds[i] = _DEAD
+                        changed = True
+                        break
+                    j += 1
+            if kinds[i] in (_JUMP, _OTHER):
+                following = i
+
+        if not changed:
+            break
+
+    out = []
+    for i, ln in enumerate(lines):
+        kind = kinds[i]
+        if kind == _DEAD:
+            continue
+        if kind == _LABEL and args[i] not in referenced and _LOCAL_LABEL_RE.match(args[i]):
+            continue
+        out.append(ln)
+    return '\n'.join(out)
+
+
+# Directives that anchor where a missing text-section header is spliced in.
+_GLOBAL_DIRECTIVE_RE = re.compile(r'^[^\S\n]*\.?global ', re.MULTILINE | re.IGNORECASE)
+_HEADER_DIRECTIVE_RE = re.compile(r'^[^\S\n]*(?:bits |default rel).*\n?', re.MULTILINE | re.IGNORECASE)
+
+# 32-bit views of the x86-64 general-purpose registers, and the legacy
+# 32-bit names (whose moves zero-extend into the full register)
+_X86_SUBREG32 = {
+    'rax': 'eax', 'rbx': 'ebx', 'rcx': 'ecx', 'rdx': 'edx',
+    'rsi': 'esi', 'rdi': 'edi', 'rbp': 'ebp', 'rsp': 'esp',
+    'r8': 'r8d', 'r9': 'r9d', 'r10': 'r10d', 'r11': 'r11d',
+    'r12': 'r12d', 'r13': 'r13d', 'r14': 'r14d', 'r15': 'r15d'
+}
+_X86_LEGACY32 = frozenset(('eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'esp'))
+
+# Register names (high-level operands, allocator names) as seen on ARM64
+_X86_TO_ARM64_REGS = {
+    # Volatile registers
+    'rax': 'x0', 'eax': 'w0', 'ax': 'w0', 'al': 'w0',
+    'rcx': 'x1', 'ecx': 'w1', 'cx': 'w1', 'cl': 'w1',
+    'rdx': 'x2', 'edx': 'w2', 'dx': 'w2', 'dl': 'w2',
+    'rsi': 'x3', 'esi': 'w3', 'si': 'w3',
+    'rdi': 'x4', 'edi': 'w4', 'di': 'w4',
+    'r8': 'x5', 'r8d': 'w5',
+    'r9': 'x6', 'r9d': 'w6',
+    'r10': 'x7', 'r10d': 'w7',
+    'r11': 'x8', 'r11d': 'w8',
+
+    # Callee-saved registers
+    'rbx': 'x19', 'ebx': 'w19', 'bx': 'w19', 'bl': 'w19',
+    'r12': 'x20', 'r12d': 'w20',
+    'r13': 'x21', 'r13d': 'w21',
+    'r14': 'x22', 'r14d': 'w22',
+    'r15': 'x23', 'r15d': 'w23',
+
+    # Special registers
+    'rbp': 'x29', 'ebp': 'w29', 'bp': 'w29',
+    'rsp': 'sp', 'esp': 'sp',
+}
+
+# Register mapping used when translating raw x86 lines to ARM64
+_X86_TO_ARM64_ASM_REGS = {
+    'rax': 'x0', 'eax': 'w0', 'ax': 'w0', 'al': 'w0',
+    'rbx': 'x1', 'ebx': 'w1', 'bx': 'w1', 'bl': 'w1',
+    'rcx': 'x2', 'ecx': 'w2', 'cx': 'w2', 'cl': 'w2',
+    'rdx': 'x3', 'edx': 'w3', 'dx': 'w3', 'dl': 'w3',
+    'rsi': 'x4', 'esi': 'w4', 'si': 'w4',
+    'rdi': 'x5', 'edi': 'w5', 'di': 'w5',
+    'rbp': 'x29', 'ebp': 'w29', 'bp': 'w29',
+    'rsp': 'sp', 'esp': 'sp',
+    'r8': 'x8', 'r8d': 'w8',
+    'r9': 'x9', 'r9d': 'w9',
+    'r10': 'x10', 'r10d': 'w10',
+    'r11': 'x11', 'r11d': 'w11',
+    'r12': 'x12', 'r12d': 'w12',
+    'r13': 'x13', 'r13d': 'w13',
+    'r14': 'x14', 'r14d': 'w14',
+    'r15': 'x15', 'r15d': 'w15',
+}
+
+# Registers handed out by allocate_reg_for, in preference order
+_X86_REG_POOL64 = ('r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15', 'rbx')
+_X86_REG_POOL32 = ('ebx', 'esi', 'edi')
+_ARM64_REG_POOL = ('x9', 'x10', 'x11', 'x12', 'x13', 'x14', 'x15')
+# Callee-saved registers under each allocator-visible name, mapped to the
+# register the function prologue saves
+_X86_CALLEE_SAVED64 = {'rbx': 'rbx', 'ebx': 'rbx'}
+_X86_CALLEE_SAVED64.update((f"r{i}{suffix}", f"r{i}") for i in range(12, 16) for suffix in ('', 'd'))
+_X86_CALLEE_SAVED32 = {'ebx': 'ebx', 'esi': 'esi', 'edi': 'edi'}
+_ARM64_CALLEE_SAVED = {f"{prefix}{i}": f"x{i}" for i in range(19, 29) for prefix in ('x', 'w')}
+
+# Callee-saved first, for functions whose body calls out
+_X86_REG_POOL64_CALLS = ('r12', 'r13', 'r14', 'r15', 'rbx', 'r8', 'r9', 'r10', 'r11')
+_ARM64_REG_POOL_CALLS = tuple(f"x{i}" for i in range(19, 29)) + _ARM64_REG_POOL
+# Volatile registers for counters of loops whose body makes no calls;
+# argument registers come last so they rarely collide with parameters
+_X86_LOOP_VOLATILE = ('r10', 'r11', 'r8', 'r9')
+_ARM64_LOOP_VOLATILE = _ARM64_REG_POOL
+
+# Inline asm lines that transfer control out and clobber volatile registers
+_ASM_CALL_RE = re.compile(r'\s*(?:call|syscall|bl|blr|svc)\b', re.IGNORECASE)
+
+# cdecl stack operands for the first 32-bit function parameters: the return
+# address sits at [ebp+4], so parameter i lives at [ebp+8+4*i]
+_STACK_PARAMS32 = tuple(f"dword [ebp+{8 + 4 * i}]" for i in range(16))
+
+
+def _escape_nasm(value):
+    return value.translate(_NASM_TABLE)
+
+
+def _escape_nasm_print(value):
+    return value.translate(_NASM_PRINT_TABLE)
+
+
+def _escape_arm64_printf(value):
+    # '\\n' / '\\r' are two-character sequences, which translate cannot match
+    return value.translate(_BACKTICK_TABLE).replace('\\n', '\\\\n').replace('\\r', '\\\\r')
+
+
 class CodeGenerator:
     def __init__(self, tokens, target='windows', arch='x86_64'):
         self.tokens = tokens
         self.pos = 0
         self.label_counter = 0
-        self.block_counter = 0
+        self._block_ids = count()
+        # generated blocks currently open; only the outermost gets markers
+        self._block_depth = 0
         self.stdlib_used = set()
-        self.string_counter = 0
+        self._string_ids = count()
+        # (label, escaped payload) for string literals; written to the
+        # backend data section once by _finalize_data()
+        self._pending_strings = []
+        # (raw value, escaper) -> label, so repeated literals share one entry
+        self._string_labels = {}
+        # escaped payload -> label, so literals escaped by different call
+        # paths (print vs. a stdlib argument) still share one entry
+        self._payload_labels = {}
         self.loop_stack = []
         self.functions = {}
         self.current_function = None
+        # Raw asm and register operands of the whole function being
+        # generated (see leaf_body_registers); None outside of func blocks
+        self._function_regs = None
+        # Shared epilogue of the function being generated: 'return' jumps to
+        # this label instead of repeating the epilogue inline. None outside
+        # of func blocks.
+        self._epilogue_label = None
+        self._return_jumps = 0
+        self._last_return_jump = None
         self.target = target
         self.arch = arch
         self.bits = 64
+        self._text_section_marker = 'section .text' if self.arch == 'x86_64' else '.text'
         
         # Initialize backend
         if self.arch == 'arm64':
             self.backend = ARM64Backend(target=target, bits=64)
-            self._reg_pool = ['x9', 'x10', 'x11', 'x12', 'x13', 'x14', 'x15'] # volatile temps
+            self._reg_pool = _ARM64_REG_POOL
         else:
             self.backend = X86Backend(target=target, bits=64)
-            self._reg_pool = ['r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15', 'rbx']
+            self._reg_pool = _X86_REG_POOL64
 
         self.register_map = {}
+        # register -> number of register_map keys bound to it, so checking
+        # whether a register is taken does not scan register_map.values()
+        self._reg_users = {}
+        # full-width callee-saved registers bound inside the current function
+        # (None outside a function); the prologue saves exactly these
+        self._saved_regs = None
+        # set once a raw ASM line emitted into a block opens the text
+        # section, so generate() need not search the finished output
+        self._has_text_section = False
+        # memoized remap_reg results; cleared whenever register_map changes
+        self._remap_cache = {}
         self.arg_regs = self.backend.arg_regs
+
+        # Builtin and stdlib call generators (keyed by call name in
+        # _builtin_calls) and the other per-mode emitters
+        self._bind_mode_emitters()
+
+        # Statement generators keyed by their leading token. Blocks also
+        # emit raw ASM lines; the top level leaves those to the source file.
+        self._dispatch = {
+            TokenType.IF: self.generate_if,
+            TokenType.FOR: self.generate_for,
+            TokenType.WHILE: self.generate_while,
+            TokenType.FUNC: self.generate_function,
+            TokenType.CALL: self.generate_call,
+            TokenType.RETURN: self.generate_return,
+            TokenType.BREAK: self.generate_break,
+            TokenType.CONTINUE: self.generate_continue,
+        }
+        self._block_dispatch = {**self._dispatch, TokenType.ASM_LINE: self.generate_asm_line}
+        # Call argument loaders keyed by argument token type
+        self._arg_loaders = {
+            TokenType.STRING: self._load_string_arg,
+            TokenType.NUMBER: self._load_number_arg,
+            TokenType.IDENTIFIER: self._load_name_arg,
+            TokenType.REGISTER: self._load_name_arg,
+        }
     
     @property
     def output(self):
@@ -38,16 +578,31 @@ class CodeGenerator:
         return self.backend.get_data_section()
     
     def generate(self):
-        while self.pos < len(self.tokens):
-            token = self.current_token()
-            
-            if token.type == TokenType.EOF:
+        dispatch = self._dispatch
+        tokens = self.tokens
+        n = len(tokens)
+        # Track the cursor locally; sync self.pos around calls that move it.
+        pos = self.pos
+        while pos < n:
+            token = tokens[pos]
+            # Raw source lines make up most of the stream and are left to
+            # the source file, so step over them before any dispatch.
+            if token.type in _PASSTHROUGH_TOKENS:
+                pos += 1
+                continue
+
+            handler = dispatch.get(token.type)
+            if handler is not None:
+                self.pos = pos
+                handler()
+                pos = self.pos
+            elif token.type == TokenType.EOF:
                 break
             # Allow a top-level 'bits 32' or 'bits 64' directive in the source
             # to switch code generation mode.
             elif token.type == TokenType.IDENTIFIER and str(token.value).lower() == 'bits':
                 # consume 'bits'
-                self.advance()
+                self.pos = pos + 1
                 num = self.current_token()
                 if num and num.type == TokenType.NUMBER:
                     try:
@@ -59,90 +614,87 @@ class CodeGenerator:
                     raise SyntaxError(f"Line {token.line}: expected number after 'bits'")
                 # skip any newline after directive
                 self.skip_newlines()
-            elif token.type == TokenType.IF:
-                self.generate_if()
-            elif token.type == TokenType.FOR:
-                self.generate_for()
-            elif token.type == TokenType.WHILE:
-                self.generate_while()
-            elif token.type == TokenType.FUNC:
-                self.generate_function()
-            elif token.type == TokenType.CALL:
-                self.generate_call()
-            elif token.type == TokenType.RETURN:
-                self.generate_return()
-            elif token.type == TokenType.BREAK:
-                self.generate_break()
-            elif token.type == TokenType.CONTINUE:
-                self.generate_continue()
-            elif token.type == TokenType.ASM_LINE:
-                # Do not inline raw ASM lines into the generated snippet.
-                # The compiler will preserve the original source file and
-                # append generated code afterwards. Skip these tokens so
-                # we don't duplicate the user's assembly.
-                self.advance()
-            elif token.type == TokenType.NEWLINE:
-                self.advance()
-            elif token.type == TokenType.INCLUDE:
-                # Include directives are rewritten at the assembly-build stage
-                # to point to the generated files. Skip emitting an include here
-                # to avoid duplicate includes in the final output.
-                self.advance()
+                pos = self.pos
             else:
-                self.advance()
+                # Raw ASM lines are not inlined into the generated snippet:
+                # the compiler preserves the original source file. Include
+                # directives are rewritten at the assembly-build stage.
+                pos += 1
+        self.pos = pos
         
         # Ensure there's a text section in the final assembly output. If the
         # user's source (or inline assembly) didn't include a `section .text`
         # declaration, prepend one so assemblers (NASM/YASM) have a code
         # section to put generated instructions into.
-        # Ensure there's a text section in the final assembly output.
-        assembly_text = '\n'.join(self.backend.get_output())
+        assembly_text = _peephole(self.backend.get_output(), x86=self.arch == 'x86_64')
         
-        # Check for text section directive (architecture-specific)
-        text_section_marker = 'section .text' if self.arch == 'x86_64' else '.text'
-        
-        if text_section_marker not in assembly_text.lower():
+        if not self._has_text_section:
             # Prefer to insert the text section before any `global` directive
             # (e.g. `global main`) so globals remain after the section line.
             # If no `global` is present, insert after any leading `bits` or
             # `default rel` directives. Fallback to the top if nothing
             # recognizable is found.
-            insert_index = 0
-            found_global = False
-            output = self.backend.get_output()
-            for i, line in enumerate(output):
-                if line.lstrip().lower().startswith('global ') or line.lstrip().lower().startswith('.global '):
-                    insert_index = i
-                    found_global = True
-                    break
+            m = _GLOBAL_DIRECTIVE_RE.search(assembly_text)
+            if m:
+                insert_at = m.start()
+            else:
+                # look for trailing bits/default rel directives and place
+                # after the last one; each match spans its whole line
+                insert_at = 0
+                last = None
+                for last in _HEADER_DIRECTIVE_RE.finditer(assembly_text):
+                    pass
+                if last:
+                    insert_at = last.end() if last.group().endswith('\n') else -1
+
+            header = self.backend.TEXT_SECTION
+            if insert_at < 0:
+                assembly_text = f"{assembly_text}\n{header}"
+            else:
+                assembly_text = f"{assembly_text[:insert_at]}{header}\n{assembly_text[insert_at:]}"
 
-            if not found_global:
-                # look for trailing bits/default rel directives and place after
-                last_dir = -1
-                for i, line in enumerate(output):
-                    s = line.strip().lower()
-                    if s.startswith('bits ') or s.startswith('default rel'):
-                        last_dir = i
-                if last_dir != -1:
-                    insert_index = last_dir + 1
-                else:
-                    insert_index = 0
+        self._finalize_data()
 
-            # Use backend method to emit text section
-            temp_output = []
-            self.backend.emit_text_section()
-            text_section_line = self.backend.get_output()[-1]
-            output.insert(insert_index, text_section_line)
-            # Remove the duplicate we just added to backend output
-            self.backend.output.pop()
+        return assembly_text, self.backend.get_data_section(), self.stdlib_used
 
-        return '\n'.join(self.backend.get_output()), self.backend.get_data_section(), self.stdlib_used
+    def _queue_string(self, value, escape):
+        """Reserve a label for a string literal and defer its data emission.
+
+        Literals whose escaped payloads are identical reuse the first label.
+        """
+        key = (value, escape)
+        label = self._string_labels.get(key)
+        if label is None:
+            payload = escape(value)
+            label = self._payload_labels.get(payload)
+            if label is None:
+                label = f"_str_{next(self._string_ids)}"
+                self._pending_strings.append((label, payload))
+                self._payload_labels[payload] = label
+            self._string_labels[key] = label
+        return label
+
+    def _finalize_data(self):
+        """Emit queued string literals into the data section."""
+        emit = self.backend.emit_string_data
+        for label, payload in self._pending_strings:
+            emit(label, payload)
+        self._pending_strings.clear()
 
     def set_bits(self, bits: int):
         """Set generation mode to 32 or 64 bit. Call before generate()."""
         if bits not in (32, 64):
             raise ValueError("bits must be 32 or 64")
+        if bits != self.bits:
+            # registers bound in the other mode are not valid names here
+            self.register_map.clear()
+            self._reg_users.clear()
+            self._remap_cache.clear()
         self.bits = bits
+        self.backend.bits = bits
+        if self.arch != 'arm64':
+            self._reg_pool = _X86_REG_POOL64 if bits == 64 else _X86_REG_POOL32
+        self._bind_mode_emitters()
     
     def current_token(self):
         return self.tokens[self.pos] if self.pos < len(self.tokens) else None
@@ -160,91 +712,97 @@ class CodeGenerator:
         # Support case-insensitive lookup for register mappings. The lexer
         # may emit registers in different cases; prefer an exact match but
         # fall back to a lowercase key if present.
-        
+        cached = self._remap_cache.get(name)
+        if cached is not None:
+            return cached
+        key = name
+
         # First, translate x86 registers to ARM64 if targeting ARM64
         if self.arch == 'arm64':
             name = self.translate_x86_reg_name(name)
         
         if name in self.register_map:
-            return self.register_map[name]
-        lower = name.lower()
-        return self.register_map.get(lower, name)
+            mapped = self.register_map[name]
+        else:
+            mapped = self.register_map.get(name.lower(), name)
+        self._remap_cache[key] = mapped
+        return mapped
+
+    def _bind_reg(self, name, reg):
+        """Map a variable/register name (and its lowercase form) to reg."""
+        users = self._reg_users
+        for key in {name, name.lower()}:
+            old = self.register_map.get(key)
+            if old is not None:
+                self._release_user(old)
+            self.register_map[key] = reg
+            users[reg] = users.get(reg, 0) + 1
+        self._remap_cache.clear()
+        if self._saved_regs is not None:
+            saved = self.callee_saved_regs().get(reg.lower())
+            if saved:
+                self._saved_regs.add(saved)
+
+    def _unbind_reg(self, name):
+        """Drop the mapping for name (original and lowercase keys)."""
+        for key in {name, name.lower()}:
+            old = self.register_map.pop(key, None)
+            if old is not None:
+                self._release_user(old)
+        self._remap_cache.clear()
+
+    def callee_saved_regs(self):
+        """Map of callee-saved register names to the register to save."""
+        if self.arch == 'arm64':
+            return _ARM64_CALLEE_SAVED
+        return _X86_CALLEE_SAVED64 if self.bits == 64 else _X86_CALLEE_SAVED32
+
+    def _release_user(self, reg):
+        count = self._reg_users[reg] - 1
+        if count:
+            self._reg_users[reg] = count
+        else:
+            del self._reg_users[reg]
     
     def translate_x86_reg_name(self, reg_name):
         """Translate x86 register names to ARM64 equivalents."""
-        x86_to_arm64 = {
-            # Volatile registers
-            'rax': 'x0', 'eax': 'w0', 'ax': 'w0', 'al': 'w0',
-            'rcx': 'x1', 'ecx': 'w1', 'cx': 'w1', 'cl': 'w1',
-            'rdx': 'x2', 'edx': 'w2', 'dx': 'w2', 'dl': 'w2',
-            'rsi': 'x3', 'esi': 'w3', 'si': 'w3',
-            'rdi': 'x4', 'edi': 'w4', 'di': 'w4',
-            'r8': 'x5', 'r8d': 'w5',
-            'r9': 'x6', 'r9d': 'w6',
-            'r10': 'x7', 'r10d': 'w7',
-            'r11': 'x8', 'r11d': 'w8',
-            
-            # Callee-saved registers
-            'rbx': 'x19', 'ebx': 'w19', 'bx': 'w19', 'bl': 'w19',
-            'r12': 'x20', 'r12d': 'w20',
-            'r13': 'x21', 'r13d': 'w21',
-            'r14': 'x22', 'r14d': 'w22',
-            'r15': 'x23', 'r15d': 'w23',
-            
-            # Special registers
-            'rbp': 'x29', 'ebp': 'w29', 'bp': 'w29',
-            'rsp': 'sp', 'esp': 'sp',
-        }
-
-        return x86_to_arm64.get(reg_name.lower(), reg_name)
-
-    def allocate_reg_for(self, orig_name):
-        # lazy-init appropriate register pool for 32/64-bit modes
-        pass
+        return _X86_TO_ARM64_REGS.get(reg_name.lower(), reg_name)
 
     def get_subreg_32(self, reg64):
-        mapping = {
-            'rax': 'eax', 'rbx': 'ebx', 'rcx': 'ecx', 'rdx': 'edx',
-            'rsi': 'esi', 'rdi': 'edi', 'rbp': 'ebp', 'rsp': 'esp',
-            'r8': 'r8d', 'r9': 'r9d', 'r10': 'r10d', 'r11': 'r11d',
-            'r12': 'r12d', 'r13': 'r13d', 'r14': 'r14d', 'r15': 'r15d'
-        }
-        return mapping.get(reg64.lower(), reg64)
+        return _X86_SUBREG32.get(reg64.lower(), reg64)
 
     def emit_mov(self, dest, src):
         # Handle 32-bit to 64-bit moves
         # If src is 32-bit (ends in 'd' or is eax/ebx/etc), move to 32-bit dest
         # which zero-extends to 64-bit.
         src_lower = src.lower()
-        if src_lower in ['eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'esp'] or \
+        if src_lower in _X86_LEGACY32 or \
            (src_lower.startswith('r') and src_lower.endswith('d') and src_lower[-2].isdigit()):
             dest_32 = self.get_subreg_32(dest)
-            self.output.append(f"    mov {dest_32}, {src}")
+            self.backend.emit_raw(f"    mov {dest_32}, {src}")
         else:
-            self.output.append(f"    mov {dest}, {src}")
+            self.backend.emit_raw(f"    mov {dest}, {src}")
 
     def allocate_reg_for(self, orig_name):
-        # lazy-init appropriate register pool for 32/64-bit modes
-        if self.bits == 32 and self._reg_pool[0].startswith('r'):
-            # 32-bit callee-saved candidates
-            self._reg_pool = ['ebx', 'esi', 'edi']
-
         # find a free callee-saved register from the pool
+        in_use = self._reg_users
         for r in self._reg_pool:
-            if r not in self.register_map.values():
+            if r not in in_use:
                 # store both the original and lowercase keys so later
                 # lookups (which may use different cases) succeed.
-                self.register_map[orig_name] = r
-                self.register_map[orig_name.lower()] = r
+                self._bind_reg(orig_name, r)
                 return r
         # fallback: reuse the first pool entry
-        self.register_map[orig_name] = self._reg_pool[0]
-        self.register_map[orig_name.lower()] = self._reg_pool[0]
+        self._bind_reg(orig_name, self._reg_pool[0])
         return self._reg_pool[0]
     
     def skip_newlines(self):
-        while self.current_token() and self.current_token().type == TokenType.NEWLINE:
-            self.advance()
+        tokens = self.tokens
+        n = len(tokens)
+        pos = self.pos
+        while pos < n and tokens[pos].type == TokenType.NEWLINE:
+            pos += 1
+        self.pos = pos
 
     def remap_asm_line(self, line: str) -> str:
         """Remap register identifiers inside a raw ASM line using current
@@ -266,34 +824,14 @@ class CodeGenerator:
 
     def translate_x86_to_arm64(self, line: str) -> str:
         """Translate x86 assembly instructions to ARM64 equivalents."""
-        import re
-        
         line = line.strip()
         if not line or line.startswith(';') or line.startswith('#'):
             return line
-        
-        # Register mapping from x86 to ARM64
-        x86_to_arm64_regs = {
-            'rax': 'x0', 'eax': 'w0', 'ax': 'w0', 'al': 'w0',
-            'rbx': 'x1', 'ebx': 'w1', 'bx': 'w1', 'bl': 'w1',
-            'rcx': 'x2', 'ecx': 'w2', 'cx': 'w2', 'cl': 'w2',
-            'rdx': 'x3', 'edx': 'w3', 'dx': 'w3', 'dl': 'w3',
-            'rsi': 'x4', 'esi': 'w4', 'si': 'w4',
-            'rdi': 'x5', 'edi': 'w5', 'di': 'w5',
-            'rbp': 'x29', 'ebp': 'w29', 'bp': 'w29',
-            'rsp': 'sp', 'esp': 'sp',
-            'r8': 'x8', 'r8d': 'w8',
-            'r9': 'x9', 'r9d': 'w9',
-            'r10': 'x10', 'r10d': 'w10',
-            'r11': 'x11', 'r11d': 'w11',
-            'r12': 'x12', 'r12d': 'w12',
-            'r13': 'x13', 'r13d': 'w13',
-            'r14': 'x14', 'r14d': 'w14',
-            'r15': 'x15', 'r15d': 'w15',
-        }
+
+        x86_to_arm64_regs = _X86_TO_ARM64_ASM_REGS
         
         # Parse instruction
-        parts = re.split(r'\s+', line, 1)
+        parts = line.split(None, 1)
         if len(parts) < 2:
             return line
         
@@ -384,7 +922,7 @@ class CodeGenerator:
                     src_arm = x86_to_arm64_regs.get(src.lower(), src)
                     return f"    cmp {dest_arm}, {src_arm}"
         
-        elif instr in ['push', 'pop']:
+        elif instr in ('push', 'pop'):
             # ARM64 doesn't have push/pop, use str/ldr with pre/post-index
             ops = operands.strip().lower()
             reg_arm = x86_to_arm64_regs.get(ops, ops)
@@ -421,16 +959,17 @@ class CodeGenerator:
             # consume size identifier
             self.advance()
 
-            # expect '['
-            if not self.current_token() or self.current_token().type != TokenType.LBRACKET:
-                raise SyntaxError(f"Line {start.line}: Expected '[' after size specifier '{size}'")
-            # consume '['
+            # consume '[' (already seen by the lookahead above)
             self.advance()
 
             # collect tokens until closing ']'
             parts = []
-            while self.current_token() and self.current_token().type != TokenType.RBRACKET:
-                inner_tok = self.current_token()
+            current_token = self.current_token
+            advance = self.advance
+            while True:
+                inner_tok = current_token()
+                if inner_tok is None or inner_tok.type == TokenType.RBRACKET:
+                    break
                 # remap registers inside the expression
                 # Handle `%` macro-parameter token sequences like `%1` or `%ident`
                 # The lexer emits '%' as a separate MODULO token followed by a
@@ -440,24 +979,24 @@ class CodeGenerator:
                     # peek next token
                     next_pos = self.pos + 1
                     next_tok = self.tokens[next_pos] if next_pos < len(self.tokens) else None
-                    if next_tok and next_tok.type in (TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER):
+                    if next_tok and next_tok.type in _SCALAR_ARG_TOKENS:
                         parts.append('%' + str(next_tok.value))
                         # consume both '%' and the following token
-                        self.advance()
-                        self.advance()
+                        advance()
+                        advance()
                         continue
                     else:
                         parts.append(str(inner_tok.value))
-                        self.advance()
+                        advance()
                         continue
 
                 if inner_tok.type == TokenType.REGISTER:
                     parts.append(self.remap_reg(inner_tok.value))
                 else:
                     parts.append(str(inner_tok.value))
-                self.advance()
+                advance()
 
-            if not self.current_token() or self.current_token().type != TokenType.RBRACKET:
+            if inner_tok is None:
                 raise SyntaxError(f"Line {start.line}: Expected closing ']' for memory operand")
             # consume ']'
             self.advance()
@@ -473,29 +1012,33 @@ class CodeGenerator:
             # consume '['
             self.advance()
             parts = []
-            while self.current_token() and self.current_token().type != TokenType.RBRACKET:
-                inner_tok = self.current_token()
+            current_token = self.current_token
+            advance = self.advance
+            while True:
+                inner_tok = current_token()
+                if inner_tok is None or inner_tok.type == TokenType.RBRACKET:
+                    break
                 # handle macro-param %n sequences as a single token
                 if inner_tok.type == TokenType.MODULO:
                     next_pos = self.pos + 1
                     next_tok = self.tokens[next_pos] if next_pos < len(self.tokens) else None
-                    if next_tok and next_tok.type in (TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER):
+                    if next_tok and next_tok.type in _SCALAR_ARG_TOKENS:
                         parts.append('%' + str(next_tok.value))
-                        self.advance()
-                        self.advance()
+                        advance()
+                        advance()
                         continue
                     else:
                         parts.append(str(inner_tok.value))
-                        self.advance()
+                        advance()
                         continue
 
                 if inner_tok.type == TokenType.REGISTER:
                     parts.append(self.remap_reg(inner_tok.value))
                 else:
                     parts.append(str(inner_tok.value))
-                self.advance()
+                advance()
 
-            if not self.current_token() or self.current_token().type != TokenType.RBRACKET:
+            if inner_tok is None:
                 raise SyntaxError(f"Line {start.line}: Expected closing ']' for memory operand")
             # consume ']'
             self.advance()
@@ -506,7 +1049,7 @@ class CodeGenerator:
             return f"[{inner_val}]", start
 
         # simple identifier, register or number
-        if tok.type in [TokenType.IDENTIFIER, TokenType.REGISTER, TokenType.NUMBER]:
+        if tok.type in _SCALAR_ARG_TOKENS:
             val = tok.value
             start = tok
             # remap registers to internal callee-saved names
@@ -518,29 +1061,23 @@ class CodeGenerator:
         # anything else is invalid here
         raise SyntaxError(f"Line {tok.line if tok else '?'}: Unexpected token '{tok.value if tok else None}' when parsing operand")
     
-    def generate_if(self):
-        # mark the start line of this high-level block so we can replace it
-        start_line = self.current_token().line if self.current_token() else -1
-        block_id = self.block_counter
-        self.block_counter += 1
-        # emit start marker
-        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
-        self.advance()
-        
-        # Expect: IF <operand> <comparison-op> <number|operand>
+    def parse_condition(self, keyword):
+        """Parse `<operand> <comparison-op> <number|operand>` after a
+        conditional keyword. Returns (var, var_token, op, rhs_val, rhs_token).
+        """
         var, var_token = self.parse_operand()
         if not var or not var_token:
-            raise SyntaxError(f"Line {var_token.line if var_token else '?'}: Expected identifier, register or memory operand after 'if'")
+            raise SyntaxError(f"Line {var_token.line if var_token else '?'}: Expected identifier, register or memory operand after '{keyword}'")
 
         op = self.current_token()
-        if not op or op.type not in [TokenType.EQ, TokenType.NE, TokenType.LT, TokenType.GT, TokenType.LE, TokenType.GE]:
-            raise SyntaxError(f"Line {op.line if op else '?'}: Expected comparison operator after '{var}' in if-statement")
+        if not op or op.type not in _CMP_OPS:
+            raise SyntaxError(f"Line {op.line if op else '?'}: Expected comparison operator after '{var}' in {keyword}-statement")
         self.advance()
 
         # Right-hand side can be a number or another operand (identifier/register/memory)
         rhs_token = self.current_token()
         if not rhs_token:
-            raise SyntaxError(f"Line {op.line if op else '?'}: Expected value after comparison in if-statement")
+            raise SyntaxError(f"Line {op.line if op else '?'}: Expected value after comparison in {keyword}-statement")
 
         # Support string literal RHS in comparisons. Common case: compare
         # a single-byte register (e.g. al) to a single-character string like
@@ -548,15 +1085,14 @@ class CodeGenerator:
         if rhs_token.type == TokenType.NUMBER:
             rhs_val = rhs_token.value
             self.advance()
-            rhs_tok_info = rhs_token = rhs_token
         elif rhs_token.type == TokenType.STRING:
             s = rhs_token.value
             # single-character string: convert to its ASCII numeric value so
             # register comparisons (cmp al, 46) work correctly
-            if var_token and var_token.type == TokenType.REGISTER and len(s) == 1:
+            if var_token.type == TokenType.REGISTER and len(s) == 1:
                 rhs_val = str(ord(s))
                 # craft a NUMBER-like token so later checks treat it as immediate
-                rhs_tok_info = Token(TokenType.NUMBER, rhs_val, rhs_token.line)
+                rhs_token = Token(TokenType.NUMBER, rhs_val, rhs_token.line)
                 # consume the string token
                 self.advance()
             else:
@@ -564,163 +1100,138 @@ class CodeGenerator:
                 # compiler stage (would require runtime string-compare).
                 raise SyntaxError(f"Line {rhs_token.line}: String comparisons other than single-character literals against registers are not supported")
         else:
-            rhs_val, rhs_tok_info = self.parse_operand()
+            rhs_val, rhs_token = self.parse_operand()
 
-        self.skip_newlines()
+        return var, var_token, op, rhs_val, rhs_token
 
-        label_next = self.backend.get_label()
-        label_end = self.backend.get_label()
+    def fold_condition(self, cond):
+        """Evaluate a comparison of two immediates at compile time.
 
-        # Decide proper cmp ordering so NASM never sees immediate, immediate or
-        # immediate as the destination. If both sides are numeric, evaluate at
-        # compile-time and emit an unconditional jump when the condition is false.
-        if var_token.type == TokenType.NUMBER and (rhs_tok_info and rhs_tok_info.type == TokenType.NUMBER):
-            # both immediates: evaluate condition now
-            a = int(var)
-            b = int(rhs_val)
-            cond_map = {
-                TokenType.EQ: (a == b), TokenType.NE: (a != b),
-                TokenType.LT: (a < b), TokenType.GT: (a > b),
-                TokenType.LE: (a <= b), TokenType.GE: (a >= b)
-            }
-            if not cond_map.get(op.type, False):
-                # condition is false at compile-time: skip true-block
-                self.backend.jump(label_next)
+        Returns True/False, or None when the condition needs a runtime cmp.
+        """
+        var, var_token, op, rhs_val, rhs_token = cond
+        if var_token.type == TokenType.NUMBER and rhs_token and rhs_token.type == TokenType.NUMBER:
+            return _CONST_CMP[op.type](int(var), int(rhs_val))
+        return None
+
+    def emit_condition_jump(self, cond, label):
+        """Emit a cmp and a branch to label taken when cond is false."""
+        var, var_token, op, rhs_val, rhs_token = cond
+        # choose left and right so left is register/memory (valid cmp dest);
+        # NASM never sees an immediate as the destination.
+        if var_token.type == TokenType.NUMBER:
+            # swap: rhs becomes left operand
+            left = rhs_val
+            # remap register if needed
+            if rhs_token and rhs_token.type == TokenType.REGISTER:
+                left = self.remap_reg(left)
+            right = var
         else:
-            # choose left and right so left is register/memory (valid cmp dest)
-            if var_token.type == TokenType.NUMBER:
-                # swap: rhs becomes left operand
-                left = rhs_val
-                # remap register if needed
-                if rhs_tok_info and rhs_tok_info.type == TokenType.REGISTER:
-                    left = self.remap_reg(left)
-                right = var
-            else:
-                left = var
-                if var_token.type == TokenType.REGISTER:
-                    left = self.remap_reg(left)
-                right = rhs_val
+            left = var
+            if var_token.type == TokenType.REGISTER:
+                left = self.remap_reg(left)
+            right = rhs_val
+
+        self.backend.compare(left, right)
+
+        # Invert condition to jump over the block if false; parse_condition
+        # only accepts operators in _JUMP_MAP
+        self.backend.cond_jump(_JUMP_MAP[op.type], label)
+
+    def generate_dead_block(self, end_tokens):
+        """Consume a block whose code can never run, emitting nothing."""
+        saved_returns = self._return_jumps, self._last_return_jump
+        has_text_section = self._has_text_section
+        mark = self.backend.mark()
+        self.generate_block(end_tokens)
+        self.backend.discard(mark)
+        self._return_jumps, self._last_return_jump = saved_returns
+        self._has_text_section = has_text_section
+
+    def _open_block(self, start_line):
+        """Emit the start marker of a generated block and return its id.
+
+        build_assembly folds nested blocks into the outermost one, so only
+        a top-level block is marked; nested blocks get None.
+        """
+        depth = self._block_depth
+        self._block_depth = depth + 1
+        if depth:
+            return None
+        block_id = next(self._block_ids)
+        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
+        return block_id
 
-            self.backend.compare(left, right)
+    def _close_block(self, block_id, end_line):
+        self._block_depth -= 1
+        if block_id is not None:
+            self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
 
-        jump_map = {
-            TokenType.EQ: '!=', TokenType.NE: '==',
-            TokenType.LT: '>=', TokenType.GT: '<=',
-            TokenType.LE: '>', TokenType.GE: '<'
-        }
-        
-        try:
-            # Invert condition to jump over the block if false
-            jm = jump_map[op.type]
-        except KeyError:
-            raise SyntaxError(f"Line {op.line}: Unsupported comparison operator '{op.value}' in if-statement")
-        
-        # Jump to label_next when condition is FALSE
-        self.backend.cond_jump(jm, label_next)
-        
-        # Generate the TRUE block (this will include the "jmp error" from your code)
-        self.generate_block([TokenType.ELIF, TokenType.ELSE, TokenType.ENDIF])
-        
-        # Only jump to end if there are elif/else blocks coming
-        has_elif_or_else = self.current_token() and self.current_token().type in [TokenType.ELIF, TokenType.ELSE]
-        if has_elif_or_else:
-            self.backend.jump(label_end)
-        
-        # Place label_next (where we jump when condition is FALSE)
-        self.backend.label(label_next)
-        
-        has_else = False
-        while self.current_token() and self.current_token().type in [TokenType.ELIF, TokenType.ELSE]:
-            if self.current_token().type == TokenType.ELIF:
+    def generate_if(self):
+        # mark the start line of this high-level block so we can replace it
+        tok = self.current_token()
+        start_line = tok.line if tok else -1
+        block_id = self._open_block(start_line)
+        self.advance()
+
+        label_end = None
+        # Set once an arm with a compile-time true condition has been
+        # emitted: every later arm is unreachable.
+        taken = False
+        keyword = 'if'
+        while True:
+            cond = self.parse_condition(keyword)
+            self.skip_newlines()
+
+            folded = None if taken else self.fold_condition(cond)
+            if taken or folded is False:
+                self.generate_dead_block(_IF_BODY_END)
+            elif folded:
+                self.generate_block(_IF_BODY_END)
+                taken = True
+            else:
+                # Jump to label_next when condition is FALSE
                 label_next = self.backend.get_label()
-                
-                self.advance()
-                var, var_token = self.parse_operand()
-                if not var or not var_token:
-                    raise SyntaxError(f"Line {var_token.line if var_token else '?'}: Expected identifier, register or memory operand after 'elif'")
-                op = self.current_token()
-                if not op or op.type not in [TokenType.EQ, TokenType.NE, TokenType.LT, TokenType.GT, TokenType.LE, TokenType.GE]:
-                    raise SyntaxError(f"Line {op.line if op else '?'}: Expected comparison operator after '{var}' in elif-statement")
-                self.advance()
+                self.emit_condition_jump(cond, label_next)
+                self.generate_block(_IF_BODY_END)
+                # Only jump to end if there are elif/else blocks coming
+                tok = self.current_token()
+                if tok and tok.type in _IF_BRANCH_TOKENS:
+                    if label_end is None:
+                        label_end = self.backend.get_label()
+                    self.backend.jump(label_end)
+                self.backend.label(label_next)
 
-                rhs_token = self.current_token()
-                if not rhs_token:
-                    raise SyntaxError(f"Line {op.line if op else '?'}: Expected value after comparison in elif-statement")
-                if rhs_token.type == TokenType.NUMBER:
-                    rhs_val = rhs_token.value
-                    self.advance()
-                    rhs_info = rhs_token
-                elif rhs_token.type == TokenType.STRING:
-                    s = rhs_token.value
-                    if var_token and var_token.type == TokenType.REGISTER and len(s) == 1:
-                        rhs_val = str(ord(s))
-                        rhs_info = Token(TokenType.NUMBER, rhs_val, rhs_token.line)
-                        self.advance()
-                    else:
-                        raise SyntaxError(f"Line {rhs_token.line}: String comparisons other than single-character literals against registers are not supported")
-                else:
-                    rhs_val, rhs_info = self.parse_operand()
-                self.skip_newlines()
+            tok = self.current_token()
+            if not tok or tok.type != TokenType.ELIF:
+                break
+            self.advance()
+            keyword = 'elif'
 
-                # Handle numeric left-side or both-numeric like in `if 1 == 1`
-                if var_token.type == TokenType.NUMBER and (rhs_info and rhs_info.type == TokenType.NUMBER):
-                    a = int(var)
-                    b = int(rhs_val)
-                    cond_map = {
-                        TokenType.EQ: (a == b), TokenType.NE: (a != b),
-                        TokenType.LT: (a < b), TokenType.GT: (a > b),
-                        TokenType.LE: (a <= b), TokenType.GE: (a >= b)
-                    }
-                    if not cond_map.get(op.type, False):
-                        self.backend.jump(label_next)
-                else:
-                    # choose left so it's register/memory
-                    if var_token.type == TokenType.NUMBER:
-                        left = rhs_val
-                        if rhs_info and rhs_info.type == TokenType.REGISTER:
-                            left = self.remap_reg(left)
-                        right = var
-                    else:
-                        left = var
-                        if var_token.type == TokenType.REGISTER:
-                            left = self.remap_reg(left)
-                        right = rhs_val
+        if tok and tok.type == TokenType.ELSE:
+            self.advance()
+            self.skip_newlines()
+            if taken:
+                self.generate_dead_block(_ELSE_BODY_END)
+            else:
+                self.generate_block(_ELSE_BODY_END)
 
-                    self.backend.compare(left, right)
-                    try:
-                        # Invert condition
-                        jm2 = jump_map[op.type]
-                    except KeyError:
-                        raise SyntaxError(f"Line {op.line}: Unsupported comparison operator '{op.value}' in elif-statement")
-                    self.backend.cond_jump(jm2, label_next)
-                
-                self.generate_block([TokenType.ELIF, TokenType.ELSE, TokenType.ENDIF])
-                self.backend.jump(label_end)
-                self.backend.label(label_next)
-                
-            elif self.current_token().type == TokenType.ELSE:
-                has_else = True
-                self.advance()
-                self.skip_newlines()
-                self.generate_block([TokenType.ENDIF])
-                break
-        
-        # Only place end label if we had elif/else
-        if has_elif_or_else:
+        # Only place end label if an arm jumps to it
+        if label_end is not None:
             self.backend.label(label_end)
 
         # mark end line and emit end marker
-        end_line = self.current_token().line if self.current_token() else start_line
-        self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
+        tok = self.current_token()
+        end_line = tok.line if tok else start_line
+        self._close_block(block_id, end_line)
 
-        if self.current_token() and self.current_token().type == TokenType.ENDIF:
+        if tok and tok.type == TokenType.ENDIF:
             self.advance()
 
     def generate_for(self):
-        start_line = self.current_token().line if self.current_token() else -1
-        block_id = self.block_counter
-        self.block_counter += 1
-        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
+        tok = self.current_token()
+        start_line = tok.line if tok else -1
+        block_id = self._open_block(start_line)
         self.advance()
         
         # Support two syntaxes:
@@ -728,7 +1239,7 @@ class CodeGenerator:
         # 2) for <var> <comparison-op> <operand>    (treated as start=0, end=<operand>)
         var_token = self.current_token()
         if not var_token:
-            raise SyntaxError(f"Line {self.current_token().line if self.current_token() else '?'}: Expected loop variable after 'for'")
+            raise SyntaxError("Line ?: Expected loop variable after 'for'")
         # Capture the raw token so we can detect register-specified loops
         is_register_var = (var_token.type == TokenType.REGISTER)
         var = var_token.value
@@ -740,25 +1251,28 @@ class CodeGenerator:
             # consume '='
             self.advance()
             # parse start operand (support numbers, identifiers, registers, or memory)
-            if self.current_token() and self.current_token().type in [TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER, TokenType.LBRACKET]:
+            tok = self.current_token()
+            if tok and tok.type in _OPERAND_ARG_TOKENS:
                 start, _ = self.parse_operand()
             else:
-                start = self.current_token().value if self.current_token() else '0'
+                start = tok.value if tok else '0'
                 self.advance()
 
             # consume optional comma
-            if self.current_token() and self.current_token().type == TokenType.COMMA:
+            tok = self.current_token()
+            if tok and tok.type == TokenType.COMMA:
                 self.advance()
 
             # parse end operand similarly
-            if self.current_token() and self.current_token().type in [TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER, TokenType.LBRACKET]:
+            tok = self.current_token()
+            if tok and tok.type in _OPERAND_ARG_TOKENS:
                 end, _ = self.parse_operand()
             else:
-                end = self.current_token().value if self.current_token() else '0'
+                end = tok.value if tok else '0'
                 self.advance()
         else:
             # Comparison-style: e.g. 'for r12d < dword [num_frames]'
-            if next_tok and next_tok.type in [TokenType.LT, TokenType.LE, TokenType.GT, TokenType.GE]:
+            if next_tok and next_tok.type in _ORDER_CMP_OPS:
                 # consume comparison operator
                 self.advance()
                 # parse the right-hand operand (could be memory/identifier/number/register)
@@ -794,10 +1308,27 @@ class CodeGenerator:
                     desired = 'x' + desired[1:]
                 # if desired is available in the register pool and not used,
                 # reserve it
-                if desired in base_prefs and desired not in self.register_map.values():
+                if desired in base_prefs and _reg_aliases(desired).isdisjoint(self._reg_users):
                     internal_reg = desired
-                    self.register_map[var] = internal_reg
-                    self.register_map[var.lower()] = internal_reg
+                    self._bind_reg(var, internal_reg)
+
+            # A body without calls can keep the counter in a volatile
+            # register, which also spares the function a callee-saved
+            # register save/restore. The register must be dead around the
+            # loop too, so only a func block qualifies (top-level code is
+            # the user's, unseen) and nothing in the whole function may
+            # mention it.
+            function_regs = self._function_regs
+            if internal_reg is None and function_regs is not None:
+                if self.leaf_body_registers(TokenType.FOR, TokenType.ENDFOR) is not None:
+                    volatile = _ARM64_LOOP_VOLATILE if self.arch == 'arm64' else _X86_LOOP_VOLATILE
+                    for reg in volatile:
+                        aliases = _reg_aliases(reg)
+                        # outer counters are bound under their 32-bit view
+                        if aliases.isdisjoint(self._reg_users) and not _mentions_any(function_regs, aliases):
+                            self._bind_reg(var, reg)
+                            internal_reg = reg
+                            break
 
             # If not reserved yet, pick a preferred one by loop depth to avoid
             # nested conflicts
@@ -805,9 +1336,9 @@ class CodeGenerator:
                 # rotate preferences by depth so nested loops choose different
                 prefs = tuple(base_prefs[loop_depth % len(base_prefs):] + base_prefs[:loop_depth % len(base_prefs)])
                 for pref in prefs:
-                    if pref not in self.register_map.values():
-                        self.register_map[var] = pref
-                        self.register_map[var.lower()] = pref
+                    # users may be recorded under any view (r13d for r13)
+                    if _reg_aliases(pref).isdisjoint(self._reg_users):
+                        self._bind_reg(var, pref)
                         internal_reg = pref
                         break
 
@@ -819,10 +1350,7 @@ class CodeGenerator:
         label_end = self.backend.get_label()
         label_continue = self.backend.get_label()
 
-        self.loop_stack.append({
-            'break': label_end,
-            'continue': label_continue
-        })
+        self.loop_stack.append(_LoopFrame(label_end, label_continue))
 
         # If start/end use 32-bit sized memory (e.g. 'dword [...]'), prefer the
         # 32-bit subregister (r12 -> r12d) to avoid operand-size mismatches.
@@ -851,273 +1379,352 @@ class CodeGenerator:
         # sized register (avoids falling back to ebx/ecx or mismatched names).
         if loop_reg != internal_reg:
             # Overwrite mapping to point to the subregister (r12d, r13d, etc.)
-            self.register_map[var] = loop_reg
-            self.register_map[var.lower()] = loop_reg
+            self._bind_reg(var, loop_reg)
 
+        header = self.backend.mark()
         self.backend.mov(loop_reg, start)
         self.backend.label(label_start)
         self.backend.compare(loop_reg, end)
         # Use jge (jump if greater or equal) so the loop does not skip the
         # final iteration when the loop variable equals the end value.
         self.backend.cond_jump('>', label_end)
-
-        self.generate_block([TokenType.ENDFOR])
+        body = self.backend.mark()
+
+        self.generate_block(_FOR_BODY_END)
+
+        # With a constant trip count and a body that never looks at the
+        # counter, count down to zero instead: `dec; jnz` replaces the
+        # per-iteration cmp/jg and increment.
+        trip_count = self.constant_trip_count(start, end)
+        if trip_count:
+            body_text = self.backend.text_since(body)
+            if not _mentions_any(body_text, _reg_aliases(internal_reg) | {var}):
+                self.backend.discard(header)
+                self.backend.mov(loop_reg, str(trip_count))
+                self.backend.label(label_start)
+                if body_text:
+                    self.backend.emit_raw(body_text[1:])
+                # return-jump offsets recorded in the body have moved
+                if self._last_return_jump is not None and self._last_return_jump[0] >= header:
+                    self._last_return_jump = None
+            else:
+                trip_count = 0
 
         self.backend.label(label_continue)
-        self.backend.add(loop_reg, '1')
-        self.backend.jump(label_start)
+        if trip_count:
+            self.backend.count_down_jump(loop_reg, label_start)
+        else:
+            self.backend.add(loop_reg, '1')
+            self.backend.jump(label_start)
         self.backend.label(label_end)
         
         self.loop_stack.pop()
         
         # free mapping (remove both original and lowercase keys)
-        if var in self.register_map:
-            del self.register_map[var]
-        if var.lower() in self.register_map:
-            del self.register_map[var.lower()]
+        self._unbind_reg(var)
 
 
         # emit end marker
-        end_line = self.current_token().line if self.current_token() else start_line
-        self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
+        tok = self.current_token()
+        end_line = tok.line if tok else start_line
+        self._close_block(block_id, end_line)
 
-        if self.current_token() and self.current_token().type == TokenType.ENDFOR:
+        if tok and tok.type == TokenType.ENDFOR:
             self.advance()
     
+    def constant_trip_count(self, start, end):
+        """Iteration count of `for v = start, end` when both bounds are
+        immediates, else 0."""
+        try:
+            count = int(end) - int(start) + 1
+        except (TypeError, ValueError):
+            return 0
+        # ARM64 only takes a 16-bit immediate in a single mov
+        if count <= 0 or (self.arch == 'arm64' and count > 0xFFFF):
+            return 0
+        return count
+
     def generate_while(self):
-        start_line = self.current_token().line if self.current_token() else -1
-        block_id = self.block_counter
-        self.block_counter += 1
-        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
+        tok = self.current_token()
+        start_line = tok.line if tok else -1
+        block_id = self._open_block(start_line)
         self.advance()
 
         # Expect: WHILE <operand> <comparison-op> <number|operand>
-        var, var_token = self.parse_operand()
-        if not var or not var_token:
-            raise SyntaxError(f"Line {var_token.line if var_token else '?'}: Expected identifier, register or memory operand after 'while'")
-
-        op = self.current_token()
-        if not op or op.type not in [TokenType.EQ, TokenType.NE, TokenType.LT, TokenType.GT, TokenType.LE, TokenType.GE]:
-            raise SyntaxError(f"Line {op.line if op else '?'}: Expected comparison operator after '{var}' in while-statement")
-        self.advance()
-
-        rhs_token = self.current_token()
-        if not rhs_token:
-            raise SyntaxError(f"Line {op.line if op else '?'}: Expected value after comparison in while-statement")
-        if rhs_token.type == TokenType.NUMBER:
-            rhs_val = rhs_token.value
-            self.advance()
-            rhs_info = rhs_token
-        else:
-            rhs_val, rhs_info = self.parse_operand()
+        cond = self.parse_condition('while')
         self.skip_newlines()
         
         label_start = self.backend.get_label()
         label_end = self.backend.get_label()
         label_continue = self.backend.get_label()
 
-        self.loop_stack.append({
-            'break': label_end,
-            'continue': label_continue
-        })
-
-        self.backend.label(label_start)
-        self.backend.label(label_continue)
+        self.loop_stack.append(_LoopFrame(label_end, label_continue))
 
-        # If both sides are numeric, evaluate condition at compile-time.
-        cmp_emitted = False
-        if var_token.type == TokenType.NUMBER and (rhs_info and rhs_info.type == TokenType.NUMBER):
-            a = int(var)
-            b = int(rhs_val)
-            cond_map = {
-                TokenType.EQ: (a == b), TokenType.NE: (a != b),
-                TokenType.LT: (a < b), TokenType.GT: (a > b),
-                TokenType.LE: (a <= b), TokenType.GE: (a >= b)
-            }
-            if not cond_map.get(op.type, False):
-                # condition false => jump to end immediately
-                self.backend.jump(label_end)
+        # If both sides are numeric, evaluate condition at compile-time: a
+        # false condition never enters the loop, a true one needs no test.
+        folded = self.fold_condition(cond)
+        if folded is False:
+            self.generate_dead_block(_WHILE_BODY_END)
         else:
-            # ensure left operand is a register/memory for valid cmp
-            if var_token.type == TokenType.NUMBER:
-                left = rhs_val
-                if rhs_info and rhs_info.type == TokenType.REGISTER:
-                    left = self.remap_reg(left)
-                right = var
-            else:
-                left = var
-                if var_token.type == TokenType.REGISTER:
-                    left = self.remap_reg(left)
-                right = rhs_val
-
-            self.backend.compare(left, right)
-            cmp_emitted = True
-
-        jump_map = {
-            TokenType.EQ: '!=', TokenType.NE: '==',
-            TokenType.LT: '>=', TokenType.GT: '<=',
-            TokenType.LE: '>', TokenType.GE: '<'
-        }
-        
-        try:
-            # Invert condition to jump out if false
-            jm = jump_map[op.type]
-        except KeyError:
-            raise SyntaxError(f"Line {op.line}: Unsupported comparison operator '{op.value}' in while-statement")
-        
-        if cmp_emitted:
-            self.backend.cond_jump(jm, label_end)
-        
-        self.generate_block([TokenType.ENDWHILE])
-        
-        self.backend.jump(label_start)
-        self.backend.label(label_end)
+            self.backend.label(label_start)
+            self.backend.label(label_continue)
+            if folded is None:
+                self.emit_condition_jump(cond, label_end)
+
+            self.generate_block(_WHILE_BODY_END)
+
+            self.backend.jump(label_start)
+            self.backend.label(label_end)
         
         self.loop_stack.pop()
         
         # emit end marker
-        end_line = self.current_token().line if self.current_token() else start_line
-        self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
+        tok = self.current_token()
+        end_line = tok.line if tok else start_line
+        self._close_block(block_id, end_line)
 
-        if self.current_token() and self.current_token().type == TokenType.ENDWHILE:
+        if tok and tok.type == TokenType.ENDWHILE:
             self.advance()
     
     def generate_function(self):
-        start_line = self.current_token().line if self.current_token() else -1
-        block_id = self.block_counter
-        self.block_counter += 1
-        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
-        self.advance()
-        func_name = self.current_token().value
-        self.advance()
+        tok = self.current_token()
+        start_line = tok.line if tok else -1
+        block_id = self._open_block(start_line)
+        func_name = self.advance().value
+        tok = self.advance()
 
         # Parse optional parameter list: func name (a, b, c)
         params = []
-        if self.current_token() and self.current_token().type == TokenType.LPAREN:
+        if tok and tok.type == TokenType.LPAREN:
+            advance = self.advance
             # consume '('
-            self.advance()
-            while self.current_token() and self.current_token().type != TokenType.RPAREN:
-                if self.current_token().type == TokenType.IDENTIFIER:
-                    params.append(self.current_token().value)
-                    self.advance()
-                elif self.current_token().type == TokenType.COMMA:
-                    self.advance()
-                else:
-                    # skip unexpected tokens
-                    self.advance()
+            tok = advance()
+            while tok and tok.type != TokenType.RPAREN:
+                if tok.type == TokenType.IDENTIFIER:
+                    params.append(tok.value)
+                # commas and unexpected tokens are skipped
+                tok = advance()
             # consume ')'
-            if self.current_token() and self.current_token().type == TokenType.RPAREN:
-                self.advance()
+            if tok and tok.type == TokenType.RPAREN:
+                advance()
 
         self.skip_newlines()
+
+        # The default 64-bit pools hand out volatile registers first, which
+        # suits leaf functions. A body that calls out needs its values in
+        # callee-saved registers to survive the call.
+        outer_pool = self._reg_pool
+        leaf_regs = self.leaf_body_registers()
+        if self.bits == 64 and leaf_regs is None:
+            self._reg_pool = _ARM64_REG_POOL_CALLS if self.arch == 'arm64' else _X86_REG_POOL64_CALLS
+        outer_function_regs = self._function_regs
+        self._function_regs = leaf_regs if leaf_regs is not None else self.leaf_body_registers(calls_ok=True)
         
         self.current_function = func_name
-        self.functions[func_name] = {
-            'start': len(self.output),
-            'code': [],
+        self._remap_cache.clear()
+        # 'start' and 'end' delimit the function's code in the backend
+        # output buffer, so its text can be read back without re-scanning
+        function_info = {
+            'start': self.backend.mark(),
+            'end': None,
             'params': params
         }
+        self.functions[func_name] = function_info
 
         # Emit function label and prologue
         self.backend.prologue(func_name, params)
+        outer_saved = self._saved_regs
+        self._saved_regs = set()
+        body = self.backend.mark()
+        outer_epilogue = (self._epilogue_label, self._return_jumps, self._last_return_jump)
+        # allocated on the first 'return' so label numbering is unaffected
+        # for functions that never return early
+        self._epilogue_label = ''
+        self._return_jumps = 0
+        self._last_return_jump = None
         
         # Map incoming parameters to internal registers
         # The backend prologue might handle some of this, but we need to
         # move args from calling convention regs to our internal regs.
-        if self.bits == 64:
-            reg_map = self.arg_regs
-            for i, p in enumerate(params):
-                internal = self.allocate_reg_for(p)
-                if i < len(reg_map):
-                    self.backend.mov(internal, reg_map[i])
-                else:
-                    # For simplicity, parameters beyond 4/6 are not supported yet.
-                    self.backend.emit_raw(f"    ; WARNING: parameter '{p}' passed on stack not supported")
-        else:
-            # 32-bit x86 specific logic (legacy)
-            # Load parameters from the stack [ebp+8], [ebp+12], ... into internal regs
-            for i, p in enumerate(params):
-                internal = self.allocate_reg_for(p)
-                offset = 8 + 4 * i
-                self.backend.mov(internal, f"dword [ebp+{offset}]")
-
-        self.generate_block([TokenType.ENDFUNC])
-
-        # function epilogue
+        self._load_params(params, leaf_regs)
+
+        self.generate_block(_FUNC_BODY_END)
+
+        # function epilogue. A 'return' jump emitted directly before it would
+        # just fall through, so drop that jump from the buffer.
+        if self._last_return_jump is not None and self._last_return_jump[1] == self.backend.mark():
+            self.backend.discard(self._last_return_jump[0])
+            self._return_jumps -= 1
+
+        # Save the callee-saved registers the body ended up using: re-emit
+        # the body behind the saves now that the set is known.
+        saved = [r for r in dict.fromkeys(self.callee_saved_regs().values()) if r in self._saved_regs]
+        if saved:
+            body_text = self.backend.text_since(body)
+            self.backend.discard(body)
+            self.backend.save_registers(saved)
+            if body_text:
+                self.backend.emit_raw(body_text[1:])
+
+        if self._return_jumps:
+            self.backend.label(self._epilogue_label)
+        self.backend.restore_registers(saved)
         self.backend.epilogue()
+        function_info['end'] = self.backend.mark()
+        self._saved_regs = outer_saved
+        self._epilogue_label, self._return_jumps, self._last_return_jump = outer_epilogue
+        self._reg_pool = outer_pool
+        self._function_regs = outer_function_regs
+        # parameters are local to the function: hand their registers back
+        for p in params:
+            self._unbind_reg(p)
         
         # emit end marker
-        end_line = self.current_token().line if self.current_token() else start_line
-        self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
+        tok = self.current_token()
+        end_line = tok.line if tok else start_line
+        self._close_block(block_id, end_line)
 
-        if self.current_token() and self.current_token().type == TokenType.ENDFUNC:
+        if tok and tok.type == TokenType.ENDFUNC:
             self.advance()
 
         self.current_function = None
     
+    def leaf_body_registers(self, open_type=TokenType.FUNC, close_type=TokenType.ENDFUNC, calls_ok=False):
+        """Scan the block body starting at the current token up to its
+        matching close_type (ENDFUNC by default).
+
+        Returns None when it contains a call (high-level or inline asm),
+        unless calls_ok is set. Otherwise returns the text of its raw asm
+        lines and register operands, as the target will see them, so
+        callers can tell which registers the body touches.
+        """
+        tokens = self.tokens
+        arm64 = self.arch == 'arm64'
+        mentioned = []
+        depth = 0
+        for pos in range(self.pos, len(tokens)):
+            tok = tokens[pos]
+            if tok.type == TokenType.CALL:
+                if not calls_ok:
+                    return None
+            elif tok.type == TokenType.ASM_LINE:
+                if not calls_ok and _ASM_CALL_RE.match(tok.value):
+                    return None
+                mentioned.append(self.translate_x86_to_arm64(tok.value) if arm64 else tok.value)
+            elif tok.type == TokenType.REGISTER:
+                mentioned.append(self.translate_x86_reg_name(tok.value) if arm64 else tok.value)
+            elif tok.type == open_type:
+                depth += 1
+            elif tok.type == close_type:
+                if not depth:
+                    break
+                depth -= 1
+        return '\n'.join(mentioned)
+
+    def _load_params64(self, params, leaf_regs=None):
+        """Move register parameters into their internal registers.
+
+        In a leaf function (leaf_regs is the text from leaf_body_registers)
+        a parameter whose incoming register the body never touches stays
+        where it is: the name is bound to the argument register and no
+        move is emitted.
+        """
+        reg_map = self.arg_regs
+        for i, p in enumerate(params):
+            if i < len(reg_map) and leaf_regs is not None and not _mentions_any(leaf_regs, _reg_aliases(reg_map[i])):
+                self._bind_reg(p, reg_map[i])
+                continue
+            internal = self.allocate_reg_for(p)
+            if i < len(reg_map):
+                self.backend.mov(internal, reg_map[i])
+            else:
+                # For simplicity, parameters beyond 4/6 are not supported yet.
+                self.backend.emit_raw(f"    ; WARNING: parameter '{p}' passed on stack not supported")
+
+    def _load_params32(self, params, leaf_regs=None):
+        """Load parameters from the stack [ebp+8], [ebp+12], ... into
+        internal registers (32-bit x86, legacy)."""
+        for i, p in enumerate(params):
+            internal = self.allocate_reg_for(p)
+            if i < len(_STACK_PARAMS32):
+                src = _STACK_PARAMS32[i]
+            else:
+                src = f"dword [ebp+{8 + 4 * i}]"
+            self.backend.mov(internal, src)
+
     def generate_return(self):
         self.advance()
-        self.backend.ret()
+        if self._epilogue_label is None:
+            # top-level return outside of any func block
+            self.backend.ret()
+            return
+        if not self._epilogue_label:
+            self._epilogue_label = self.backend.get_label()
+        self.backend.set_return_value()
+        start = self.backend.mark()
+        self.backend.jump(self._epilogue_label)
+        self._last_return_jump = (start, self.backend.mark())
+        self._return_jumps += 1
     
     def generate_break(self):
         if not self.loop_stack:
             raise SyntaxError(f"Line {self.current_token().line}: 'break' outside loop")
-        self.backend.jump(self.loop_stack[-1]['break'])
+        self.backend.jump(self.loop_stack[-1].break_label)
         self.advance()
     
     def generate_continue(self):
         if not self.loop_stack:
             raise SyntaxError(f"Line {self.current_token().line}: 'continue' outside loop")
-        self.backend.jump(self.loop_stack[-1]['continue'])
+        self.backend.jump(self.loop_stack[-1].continue_label)
         self.advance()
     
     def generate_block(self, end_tokens):
-        while self.current_token() and self.current_token().type not in end_tokens:
-            token = self.current_token()
-            
-            if token.type == TokenType.IF:
-                self.generate_if()
-            elif token.type == TokenType.FOR:
-                self.generate_for()
-            elif token.type == TokenType.WHILE:
-                self.generate_while()
-            elif token.type == TokenType.FUNC:
-                self.generate_function()
-            elif token.type == TokenType.CALL:
-                self.generate_call()
-            elif token.type == TokenType.RETURN:
-                self.generate_return()
-            elif token.type == TokenType.BREAK:
-                self.generate_break()
-            elif token.type == TokenType.CONTINUE:
-                self.generate_continue()
-            elif token.type == TokenType.ASM_LINE:
-                # Remap register names inside raw ASM lines so that loop
-                # variables previously bound to callee-saved registers are
-                # used consistently in the emitted assembly.
-                line = self.remap_asm_line(token.value)
-                # If targeting ARM64, translate x86 instructions to ARM64
-                if self.arch == 'arm64':
-                    line = self.translate_x86_to_arm64(line)
-                self.backend.emit_raw(line)
-                self.advance()
-            elif token.type == TokenType.INCLUDE:
-                # Skip here as well; original source will be rewritten to
-                # reference the generated file path by the compiler build step.
-                self.advance()
-            elif token.type == TokenType.NEWLINE:
-                self.advance()
+        dispatch = self._block_dispatch
+        if not isinstance(end_tokens, frozenset):
+            end_tokens = frozenset(end_tokens)
+        tokens = self.tokens
+        n = len(tokens)
+        pos = self.pos
+        while pos < n:
+            token = tokens[pos]
+            if token.type == TokenType.NEWLINE:
+                pos += 1
+                continue
+            if token.type in end_tokens:
+                break
+
+            handler = dispatch.get(token.type)
+            if handler is not None:
+                self.pos = pos
+                handler()
+                pos = self.pos
             elif token.type == TokenType.EOF:
                 break
             else:
-                self.advance()
+                # Newlines and include directives (rewritten by the build step)
+                pos += 1
+        self.pos = pos
+
+    def generate_asm_line(self):
+        # Remap register names inside raw ASM lines so that loop
+        # variables previously bound to callee-saved registers are
+        # used consistently in the emitted assembly.
+        line = self.remap_asm_line(self.current_token().value)
+        # If targeting ARM64, translate x86 instructions to ARM64
+        if self.arch == 'arm64':
+            line = self.translate_x86_to_arm64(line)
+        # Raw lines are the only way user text reaches the output, so this
+        # is where a text section directive (architecture-specific) shows up.
+        if not self._has_text_section and self._text_section_marker in line.lower():
+            self._has_text_section = True
+        self.backend.emit_raw(line + _ASM_LINE_TAG)
+        self.advance()
     
     def generate_call(self):
         # capture start line (the CALL token)
-        start_line = self.current_token().line if self.current_token() else -1
-        block_id = self.block_counter
-        self.block_counter += 1
-        self.backend.emit_raw(f"; __GEN_START__ {block_id} {start_line}")
+        tok = self.current_token()
+        start_line = tok.line if tok else -1
+        block_id = self._open_block(start_line)
         self.advance()
 
         func_name = self.current_token().value
@@ -1127,24 +1734,28 @@ class CodeGenerator:
 
         # Support two call syntaxes: call foo a, b  OR call foo(a, b)
         # Also support lean syntax with * prefix: call foo(*[addr], value)
-        if self.current_token() and self.current_token().type == TokenType.LPAREN:
+        current_token = self.current_token
+        advance = self.advance
+        tok = current_token()
+        if tok and tok.type == TokenType.LPAREN:
             # consume '('
-            self.advance()
-            while self.current_token() and self.current_token().type != TokenType.RPAREN:
-                tok = self.current_token()
+            advance()
+            while True:
+                tok = current_token()
+                if tok is None or tok.type == TokenType.RPAREN:
+                    break
                 use_lea = False
                 
                 # Check for * prefix (lean syntax for lea)
                 if tok.type == TokenType.ASTERISK:
                     use_lea = True
-                    self.advance()
-                    tok = self.current_token()
+                    tok = advance()
                 
                 if tok.type == TokenType.STRING:
                     # String literals are handled as-is
                     args.append((tok, use_lea))
-                    self.advance()
-                elif tok.type in [TokenType.IDENTIFIER, TokenType.NUMBER, TokenType.REGISTER, TokenType.LBRACKET]:
+                    advance()
+                elif tok.type in _OPERAND_ARG_TOKENS:
                     # Use parse_operand to handle memory operands like [bufferSize]
                     operand_str, operand_tok = self.parse_operand()
                     if operand_str and operand_tok:
@@ -1161,40 +1772,24 @@ class CodeGenerator:
                             pseudo_tok = Token(TokenType.IDENTIFIER, operand_str, operand_tok.line)
                         args.append((pseudo_tok, use_lea))
                 elif tok.type == TokenType.COMMA:
-                    self.advance()
+                    advance()
                 else:
-                    self.advance()
+                    advance()
             # consume ')'
-            if self.current_token() and self.current_token().type == TokenType.RPAREN:
-                self.advance()
+            if tok and tok.type == TokenType.RPAREN:
+                advance()
         else:
-            while self.current_token() and self.current_token().type in [TokenType.STRING, TokenType.IDENTIFIER, TokenType.NUMBER, TokenType.REGISTER]:
-                args.append((self.current_token(), False))
-                self.advance()
-                if self.current_token() and self.current_token().type == TokenType.COMMA:
-                    self.advance()
+            while tok and tok.type in _BARE_ARG_TOKENS:
+                args.append((tok, False))
+                tok = advance()
+                if tok and tok.type == TokenType.COMMA:
+                    tok = advance()
 
         self.stdlib_used.add(func_name)
 
-        if func_name == 'print':
-            self.generate_print(args)
-        elif func_name == 'println':
-            self.generate_print(args)
-            if self.bits == 64:
-                self.backend.load_address(self.arg_regs[0], "_newline_str")
-                self.backend.call_function("_print_string")
-            else:
-                # push string pointer and call (cdecl-like)
-                self.backend.emit_raw("    push dword _newline_str")
-                self.backend.call_function("_print_string")
-                self.backend.emit_raw("    add esp, 4")
-            self.stdlib_used.add('print')
-        elif func_name == 'scan':
-            self.generate_scan(args)
-        elif func_name == 'scanint':
-            self.generate_scanint(args)
-        elif func_name in ['strlen','strcpy','strcmp','strcat','abs','min','max','pow','arraysum','arrayfill','arraycopy','memset','memcpy','rand','sleep']:
-            self.generate_stdlib_call(func_name, args)
+        builtin = self._builtin_calls.get(func_name)
+        if builtin is not None:
+            builtin(args)
         elif func_name == 'printf' and self.arch == 'arm64':
             # Special handling for printf on ARM64 - variadic function needs stack args
             if args:
@@ -1207,10 +1802,7 @@ class CodeGenerator:
                 # First arg is format string (in x0)
                 first_arg, _ = args[0]
                 if first_arg.type == TokenType.STRING:
-                    str_label = f"_str_{self.string_counter}"
-                    self.string_counter += 1
-                    escaped_str = first_arg.value.replace('`', '\\`').replace('\\n', '\\\\n').replace('\\r', '\\\\r')
-                    self.backend.emit_string_data(str_label, escaped_str)
+                    str_label = self._queue_string(first_arg.value, _escape_arm64_printf)
                     self.backend.load_address("x0", str_label)
                 
                 # Remaining args go on the stack
@@ -1219,13 +1811,10 @@ class CodeGenerator:
                         self.backend.emit_raw(f"    mov x8, #{arg.value}")
                         self.backend.emit_raw(f"    str x8, [sp, #{i * 8}]")
                     elif arg.type == TokenType.STRING:
-                        str_label = f"_str_{self.string_counter}"
-                        self.string_counter += 1
-                        escaped_str = arg.value.replace('`', '\\`').replace('\\n', '\\\\n').replace('\\r', '\\\\r')
-                        self.backend.emit_string_data(str_label, escaped_str)
+                        str_label = self._queue_string(arg.value, _escape_arm64_printf)
                         self.backend.load_address("x8", str_label)
                         self.backend.emit_raw(f"    str x8, [sp, #{i * 8}]")
-                    elif arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
+                    elif arg.type in _NAME_TOKENS:
                         val = self.remap_reg(arg.value)
                         self.backend.emit_raw(f"    str {val}, [sp, #{i * 8}]")
                 
@@ -1234,9 +1823,6 @@ class CodeGenerator:
                 self.backend.emit_raw(f"    add sp, sp, #{stack_size}")
         else:
             # Generic function call
-            # Use backend-provided argument registers instead of hardcoded x86 names
-            reg_params = self.arg_regs
-            
             # Determine calling convention parameters
             if self.target == 'windows':
                 shadow_space = 32
@@ -1275,37 +1861,7 @@ class CodeGenerator:
                     self.backend.emit_raw(f"    sub rsp, {total_stack_adj}")
                 
                 # Load register arguments
-                # Handle different argument types: strings, numbers, identifiers, and memory operands
-                # Each arg is now a tuple (token, use_lea)
-                for i, (arg, use_lea) in enumerate(reg_args):
-                    dest_reg = reg_params[i]
-                    
-                    if arg.type == TokenType.STRING:
-                        str_label = f"_str_{self.string_counter}"
-                        self.string_counter += 1
-                        escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\n').replace('\r', '\\r')
-                        self.backend.emit_string_data(str_label, escaped_str)
-                        self.backend.load_address(dest_reg, str_label)
-                    elif arg.type == TokenType.NUMBER:
-                        self.output.append(f"    mov {dest_reg}, {arg.value}")
-                    elif arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                        src_val = self.remap_reg(arg.value)
-                        
-                        # Check if we should use lea (lean syntax with * prefix)
-                        if use_lea:
-                            # Use lea to load the effective address
-                            self.backend.load_effective_address(dest_reg, src_val)
-                        else:
-                            # Check if this is a memory operand (starts with '[')
-                            # Memory operands need to be dereferenced with mov, not lea
-                            if src_val.startswith('['):
-                                # Memory operand: use mov to dereference
-                                # Use the operand as-is without adding size prefix
-                                self.output.append(f"    mov {dest_reg}, {src_val}")
-                            else:
-                                # Regular identifier or register
-                                if src_val != dest_reg:
-                                    self.emit_mov(dest_reg, src_val)
+                self._emit_call_args(reg_args)
 
                 # Place stack arguments at fixed offsets relative to RSP
                 # Shadow space is at [rsp+0]..[rsp+31]
@@ -1318,29 +1874,17 @@ class CodeGenerator:
                     # We can't mov mem, imm64 (for large constants), but small ones are ok.
                     # Safest is to move to rax first then to stack.
                     
-                    if arg.type == TokenType.STRING:
-                        str_label = f"_str_{self.string_counter}"
-                        self.string_counter += 1
-                        escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\n').replace('\r', '\\r')
-                        self.backend.emit_string_data(str_label, escaped_str)
-                        self.backend.load_address("rax", str_label)
-                        self.output.append(f"    mov qword [rsp + {offset}], rax")
-                        
-                    elif arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
+                    if arg.type in _NAME_TOKENS:
                         val = self.remap_reg(val)
-                        if val.startswith('['):
-                             # Memory to memory -> use rax
-                             self.output.append(f"    mov rax, {val}")
-                             self.output.append(f"    mov qword [rsp + {offset}], rax")
-                        else:
-                             # Register to memory -> direct mov ok
-                             self.output.append(f"    mov qword [rsp + {offset}], {val}")
-                             
-                    elif arg.type == TokenType.NUMBER:
-                        # Immediate to memory -> dword/qword specifier needed
-                        # For safety with large numbers, use rax
-                        self.output.append(f"    mov rax, {val}")
-                        self.output.append(f"    mov qword [rsp + {offset}], rax")
+                        if not val.startswith('['):
+                            # Register to memory -> direct mov ok
+                            self.backend.emit_raw(f"    mov qword [rsp + {offset}], {val}")
+                            continue
+                    if arg.type in _BARE_ARG_TOKENS:
+                        # Strings, memory operands and immediates (which
+                        # may not fit an imm32) go through rax
+                        self._emit_arg_into("rax", arg)
+                        self.backend.emit_raw(f"    mov qword [rsp + {offset}], rax")
 
                 # Call the function
                 self.backend.call_function(func_name)
@@ -1358,143 +1902,192 @@ class CodeGenerator:
                         val = val.replace('\n', '\\n').replace('\r', '\\r')
                         safe_args.append(val)
                     arg_str = ', '.join(safe_args)
-                    self.output.append(f"    ; Call {func_name} ({arg_str})")
-                    
-                for arg, use_lea in reversed(args):
-                    if arg.type == TokenType.STRING:
-                        str_label = f"_str_{self.string_counter}"
-                        self.string_counter += 1
-                        escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\n').replace('\r', '\\r')
-                        self.backend.emit_string_data(str_label, escaped_str)
-                        self.output.append(f"    push dword {str_label}")
-                    elif arg.type in [TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER]:
-                        val = arg.value
-                        if arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                            val = self.remap_reg(arg.value)
-                        self.output.append(f"    push {val}")
+                    self.backend.emit_raw(f"    ; Call {func_name} ({arg_str})")
+                self._emit_call_args(args)
 
                 # call with underscore prefix for user functions on x86
                 self.backend.call_function(f"_{func_name}")
                 if args:
-                    self.backend.emit_raw(f"    add esp, {4 * len(args)}")
+                    self.backend.release_stack(4 * len(args))
 
         # emit end marker for this call
-        end_line = self.current_token().line if self.current_token() else start_line
-        self.backend.emit_raw(f"; __GEN_END__ {block_id} {end_line}")
+        tok = self.current_token()
+        end_line = tok.line if tok else start_line
+        self._close_block(block_id, end_line)
     
-    def generate_print(self, args):
+    # The builtin emitters come in 64-bit (register arguments) and 32-bit
+    # (cdecl, stack arguments) variants; _bind_mode_emitters installs the
+    # pair for the current mode as generate_print, _emit_call_args, etc.
+
+    def _bind_mode_emitters(self):
+        """Point the mode-specific emitters at the current bit width."""
+        if self.bits == 64:
+            self.generate_print = self._generate_print64
+            self.generate_println = self._generate_println64
+            self.generate_scan = self._generate_scan64
+            self.generate_scanint = self._generate_scanint64
+            self.generate_stdlib_call = self._generate_stdlib_call64
+            self._emit_call_args = self._emit_call_args64
+            self._load_params = self._load_params64
+        else:
+            self.generate_print = self._generate_print32
+            self.generate_println = self._generate_println32
+            self.generate_scan = self._generate_scan32
+            self.generate_scanint = self._generate_scanint32
+            self.generate_stdlib_call = self._generate_stdlib_call32
+            self._emit_call_args = self._emit_call_args32
+            self._load_params = self._load_params32
+        # call name -> generator; stdlib helpers share generate_stdlib_call
+        builtin_calls = {name: partial(self.generate_stdlib_call, name) for name in _STDLIB_FUNCS}
+        builtin_calls.update({
+            'print': self.generate_print,
+            'println': self.generate_println,
+            'scan': self.generate_scan,
+            'scanint': self.generate_scanint,
+        })
+        self._builtin_calls = builtin_calls
+
+    def _generate_print64(self, args):
         if not args:
             return
-        
         # Unpack tuple (arg, use_lea) - use_lea is ignored for print
         arg, _ = args[0]
-        
-        if self.bits == 64:
-            arg_reg = self.arg_regs[0]
-            if arg.type == TokenType.STRING:
-                str_label = f"_str_{self.string_counter}"
-                self.string_counter += 1
-                escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\\\n').replace('\r', '\\\\r')
-                self.backend.emit_string_data(str_label, escaped_str)
-                self.backend.load_address(arg_reg, str_label)
-                self.backend.call_function("_print_string")
-            elif arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                val = self.remap_reg(arg.value)
-                self.emit_mov(arg_reg, val)
-                self.backend.call_function("_print_number")
-            elif arg.type == TokenType.NUMBER:
-                self.backend.mov(arg_reg, arg.value)
-                self.backend.call_function("_print_number")
-        else:
-            # 32-bit: push arguments and call cdecl-style
-            if arg.type == TokenType.STRING:
-                str_label = f"_str_{self.string_counter}"
-                self.string_counter += 1
-                escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\\\n').replace('\r', '\\\\r')
-                self.backend.emit_string_data(str_label, escaped_str)
-                self.backend.emit_raw(f"    push dword {str_label}")
-                self.backend.call_function("_print_string")
-                self.backend.emit_raw("    add esp, 4")
-            elif arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                val = self.remap_reg(arg.value)
-                self.backend.emit_raw(f"    push {val}")
-                self.backend.call_function("_print_number")
-                self.backend.emit_raw("    add esp, 4")
-            elif arg.type == TokenType.NUMBER:
-                self.backend.emit_raw(f"    push {arg.value}")
-                self.backend.call_function("_print_number")
-                self.backend.emit_raw("    add esp, 4")
-    
-    def generate_scan(self, args):
+        if arg.type not in _BARE_ARG_TOKENS:
+            return
+        self._emit_arg_into(self.arg_regs[0], arg, escape=_escape_nasm_print)
+        self.backend.call_function("_print_string" if arg.type == TokenType.STRING else "_print_number")
+
+    def _generate_print32(self, args):
         if not args:
             return
+        arg, _ = args[0]
+        if arg.type not in _BARE_ARG_TOKENS:
+            return
+        # push arguments and call cdecl-style
+        self._emit_arg_push(arg, escape=_escape_nasm_print)
+        self.backend.call_function("_print_string" if arg.type == TokenType.STRING else "_print_number")
+        self.backend.release_stack(4)
+
+    def _generate_println64(self, args):
+        self._generate_print64(args)
+        self.backend.load_address(self.arg_regs[0], "_newline_str")
+        self.backend.call_function("_print_string")
+        self.stdlib_used.add('print')
+
+    def _generate_println32(self, args):
+        self._generate_print32(args)
+        # push string pointer and call (cdecl-like)
+        self.backend.push_arg("dword _newline_str")
+        self.backend.call_function("_print_string")
+        self.backend.release_stack(4)
+        self.stdlib_used.add('print')
+
+    @staticmethod
+    def _scan_operands(args):
+        """Buffer name and size operands of a scan call."""
         # Unpack tuples
         buffer, _ = args[0]
-        buffer = buffer.value
         if len(args) > 1:
             buffer_size_arg, _ = args[1]
-            buffer_size = buffer_size_arg.value
-        else:
-            buffer_size = "256"
-        if self.bits == 64:
-            self.output.append(f"    lea {self.arg_regs[0]}, [rel {buffer}]")
-            self.output.append(f"    mov {self.arg_regs[1]}, {buffer_size}")
-            self.output.append(f"    call _scan_string")
-        else:
-            # push size then buffer pointer
-            self.output.append(f"    push {buffer_size}")
-            self.output.append(f"    push dword {buffer}")
-            self.output.append(f"    call _scan_string")
-            self.output.append(f"    add esp, 8")
-    
-    def generate_scanint(self, args):
+            return buffer.value, buffer_size_arg.value
+        return buffer.value, "256"
+
+    def _generate_scan64(self, args):
+        if not args:
+            return
+        buffer, buffer_size = self._scan_operands(args)
+        self.backend.emit_raw(f"    lea {self.arg_regs[0]}, [rel {buffer}]")
+        self.backend.emit_raw(f"    mov {self.arg_regs[1]}, {buffer_size}")
+        self.backend.emit_raw("    call _scan_string")
+
+    def _generate_scan32(self, args):
+        if not args:
+            return
+        buffer, buffer_size = self._scan_operands(args)
+        # push size then buffer pointer
+        self.backend.push_arg(buffer_size)
+        self.backend.push_arg(f"dword {buffer}")
+        self.backend.call_function("_scan_string")
+        self.backend.release_stack(8)
+
+    def _generate_scanint64(self, args):
         if not args:
             return
-        # Unpack tuple
         var_arg, _ = args[0]
-        var = var_arg.value
-        if self.bits == 64:
-            self.output.append(f"    lea {self.arg_regs[0]}, [rel {var}]")
-            self.output.append(f"    call _scanint")
-        else:
-            self.output.append(f"    push dword {var}")
-            self.output.append(f"    call _scanint")
-            self.output.append(f"    add esp, 4")
-    
-    def generate_stdlib_call(self, func_name, args):
-        # Support both x64 (register) and x86 (stack push) argument passing
-        if self.bits == 64:
-            # Map arguments to registers
-            reg_map = self.arg_regs
-            # Unpack tuples (arg, use_lea)
-            for i, (arg, use_lea) in enumerate(args[:4]):
-                if i < len(reg_map):
-                    if arg.type == TokenType.STRING:
-                        str_label = f"_str_{self.string_counter}"
-                        self.string_counter += 1
-                        escaped_str = arg.value.replace('`', '\\`').replace('\n', '\\n').replace('\r', '\\r')
-                        self.backend.emit_string_data(str_label, escaped_str)
-                        self.output.append(f"    lea {reg_map[i]}, [rel {str_label}]")
-                    elif arg.type in [TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER]:
-                        val = arg.value
-                        if arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                            val = self.remap_reg(arg.value)
-                        self.output.append(f"    mov {reg_map[i]}, {val}")
-            self.output.append(f"    call _{func_name}")
-        else:
-            # 32-bit: push args right-to-left and call underscore-prefixed name
-            for arg, use_lea in reversed(args):
-                if arg.type == TokenType.STRING:
-                    str_label = f"_str_{self.string_counter}"
-                    self.string_counter += 1
-                    escaped_str = arg.value.replace('`', '\\`')
-                    self.backend.emit_string_data(str_label, escaped_str)
-                    self.output.append(f"    push dword {str_label}")
-                elif arg.type in [TokenType.NUMBER, TokenType.IDENTIFIER, TokenType.REGISTER]:
-                    val = arg.value
-                    if arg.type in [TokenType.REGISTER, TokenType.IDENTIFIER]:
-                        val = self.remap_reg(arg.value)
-                    self.output.append(f"    push {val}")
-            self.output.append(f"    call _{func_name}")
-            if args:
-                self.output.append(f"    add esp, {4 * len(args)}")
+        self.backend.emit_raw(f"    lea {self.arg_regs[0]}, [rel {var_arg.value}]")
+        self.backend.emit_raw("    call _scanint")
+
+    def _generate_scanint32(self, args):
+        if not args:
+            return
+        var_arg, _ = args[0]
+        self.backend.push_arg(f"dword {var_arg.value}")
+        self.backend.call_function("_scanint")
+        self.backend.release_stack(4)
+
+    def _generate_stdlib_call64(self, func_name, args):
+        self._emit_call_args64(args)
+        self.backend.emit_raw(f"    call _{func_name}")
+
+    def _generate_stdlib_call32(self, func_name, args):
+        self._emit_call_args32(args)
+        self.backend.call_function(f"_{func_name}")
+        if args:
+            self.backend.release_stack(4 * len(args))
+
+    def _emit_call_args64(self, args):
+        """Load the leading call arguments into the calling convention
+        registers (extra arguments are left to the caller).
+
+        Each arg is a tuple (token, use_lea).
+        """
+        emit_arg_into = self._emit_arg_into
+        for dest_reg, (arg, use_lea) in zip(self.arg_regs, args):
+            emit_arg_into(dest_reg, arg, use_lea)
+
+    def _emit_call_args32(self, args):
+        """Push every call argument right-to-left, cdecl style."""
+        emit_arg_push = self._emit_arg_push
+        for arg, use_lea in reversed(args):
+            emit_arg_push(arg)
+
+    def _emit_arg_into(self, dest, arg, use_lea=False, escape=_escape_nasm):
+        """Load one call argument token into register dest.
+
+        Tokens without a loader in _arg_loaders emit nothing.
+        """
+        loader = self._arg_loaders.get(arg.type)
+        if loader is not None:
+            loader(dest, arg, use_lea, escape)
+
+    def _load_string_arg(self, dest, arg, use_lea, escape):
+        self.backend.load_address(dest, self._queue_string(arg.value, escape))
+
+    def _load_number_arg(self, dest, arg, use_lea, escape):
+        self.backend.mov(dest, arg.value)
+
+    def _load_name_arg(self, dest, arg, use_lea, escape):
+        src_val = self.remap_reg(arg.value)
+
+        # Check if we should use lea (lean syntax with * prefix)
+        if use_lea:
+            # Use lea to load the effective address
+            self.backend.load_effective_address(dest, src_val)
+        elif src_val.startswith('['):
+            # Memory operand: use mov to dereference
+            # Use the operand as-is without adding size prefix
+            self.backend.emit_raw(f"    mov {dest}, {src_val}")
+        elif src_val != dest:
+            # Regular identifier or register
+            self.emit_mov(dest, src_val)
+
+    def _emit_arg_push(self, arg, escape=_escape_nasm):
+        """Push one call argument token (32-bit cdecl)."""
+        if arg.type == TokenType.STRING:
+            str_label = self._queue_string(arg.value, escape)
+            self.backend.push_arg(f"dword {str_label}")
+        elif arg.type in _SCALAR_ARG_TOKENS:
+            val = arg.value
+            if arg.type in _NAME_TOKENS:
+                val = self.remap_reg(arg.value)
+            self.backend.push_arg(val)
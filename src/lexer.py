@@ -1,67 +1,118 @@
+import re
+from sys import intern
+
 from src.token import Token, TokenType
 
+# Token types emitted per line, bound once: an enum member lookup costs
+# several times a module global on the hot path
+_TT_ASM_LINE = TokenType.ASM_LINE
+_TT_NEWLINE = TokenType.NEWLINE
+_TT_REGISTER = TokenType.REGISTER
+_TT_IDENTIFIER = TokenType.IDENTIFIER
+_TT_NUMBER = TokenType.NUMBER
+_TT_STRING = TokenType.STRING
+
+# Scanner for keyword lines. Characters that match no alternative
+# (whitespace, stray punctuation) are skipped by finditer.
+#   STRING  - single or double quoted, backslash escapes the next char
+#   NUMBER  - optional sign directly followed by hex (0x), binary (0b) or
+#             decimal digits
+#   OP      - two-character comparisons before their one-character prefixes
+#   COMMENT - ';' ends the line
+#   QUOTE   - an opening quote STRING could not close
+_TOKEN_RE = re.compile(r"""
+    (?P<STRING>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<NUMBER>[+-]?(?:0[xX][0-9a-fA-F]*|0[bB][01]*|\d+))
+  | (?P<OP>==|!=|<=|>=|[<>=,()\[\]+\-*/%])
+  | (?P<IDENT>[^\W\d]\w*)
+  | (?P<COMMENT>;)
+  | (?P<QUOTE>["'])
+""", re.VERBOSE)
+
+_REGISTERS = frozenset((
+    'rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp',
+    'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15',
+    'eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'esp',
+    'ax', 'bx', 'cx', 'dx', 'si', 'di', 'bp', 'sp',
+    'al', 'bl', 'cl', 'dl', 'ah', 'bh', 'ch', 'dh'
+))
+
+# Register names: accept base registers like 'r12' and 32-bit subregister
+# forms like 'r12d'. Many users will write 'r12d' when they want the 32-bit
+# subregister; the lexer should treat these as registers so later codegen
+# can handle mapping correctly.
+_REGISTER_WORDS = _REGISTERS | {reg + 'd' for reg in _REGISTERS}
+
+_KEYWORDS = {
+    'if': TokenType.IF, 'elif': TokenType.ELIF,
+    'else': TokenType.ELSE, 'endif': TokenType.ENDIF,
+    'for': TokenType.FOR, 'endfor': TokenType.ENDFOR,
+    'while': TokenType.WHILE, 'endwhile': TokenType.ENDWHILE,
+    'break': TokenType.BREAK, 'continue': TokenType.CONTINUE,
+    'func': TokenType.FUNC, 'endfunc': TokenType.ENDFUNC,
+    'return': TokenType.RETURN, 'call': TokenType.CALL,
+    'var': TokenType.VAR, 'let': TokenType.LET
+}
+
+# Backslash escapes understood inside string literals; any other
+# backslash sequence is kept as written
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', "'": "'", '\\': '\\'}
+_ESCAPE_RE = re.compile(r"""\\([ntr"'\\])""")
+
+
+def _unescape(m):
+    return _ESCAPES[m.group(1)]
+
+
+_OPERATOR_TOKENS = {
+    '==': TokenType.EQ, '!=': TokenType.NE,
+    '<=': TokenType.LE, '>=': TokenType.GE,
+    '<': TokenType.LT, '>': TokenType.GT,
+    '=': TokenType.ASSIGN, ',': TokenType.COMMA,
+    '(': TokenType.LPAREN, ')': TokenType.RPAREN,
+    '[': TokenType.LBRACKET, ']': TokenType.RBRACKET,
+    '+': TokenType.PLUS, '-': TokenType.MINUS,
+    '*': TokenType.ASTERISK, '/': TokenType.DIVIDE,
+    '%': TokenType.MODULO
+}
+
 
 class Lexer:
     def __init__(self, source):
-        self.source = source
-        self.lines = source.split('\n')
+        # Same line splitting as build_assembly, so token line numbers
+        # match the source lines generated blocks replace
+        self.lines = source.splitlines()
         self.tokens = []
-        
-        self.registers = {
-            'rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp',
-            'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15',
-            'eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'esp',
-            'ax', 'bx', 'cx', 'dx', 'si', 'di', 'bp', 'sp',
-            'al', 'bl', 'cl', 'dl', 'ah', 'bh', 'ch', 'dh'
-        }
-        
-        self.keywords = {
-            'if': TokenType.IF, 'elif': TokenType.ELIF,
-            'else': TokenType.ELSE, 'endif': TokenType.ENDIF,
-            'for': TokenType.FOR, 'endfor': TokenType.ENDFOR,
-            'while': TokenType.WHILE, 'endwhile': TokenType.ENDWHILE,
-            'break': TokenType.BREAK, 'continue': TokenType.CONTINUE,
-            'func': TokenType.FUNC, 'endfunc': TokenType.ENDFUNC,
-            'return': TokenType.RETURN, 'call': TokenType.CALL,
-            'var': TokenType.VAR, 'let': TokenType.LET
-        }
-    
+
     def tokenize(self):
-        i = 0
-        total = len(self.lines)
-        while i < total:
-            line_num = i + 1
-            original_line = self.lines[i]
+        append = self.tokens.append
+        lines = iter(enumerate(self.lines, 1))
+        for line_num, original_line in lines:
             line = original_line.strip()
 
             # Preserve blank lines and pure-ASM/comment lines as ASM_LINE
             if not line or line.startswith(';'):
-                self.tokens.append(Token(TokenType.ASM_LINE, original_line, line_num))
-                i += 1
+                append(Token(_TT_ASM_LINE, original_line, line_num))
                 continue
 
             # Capture macro blocks as a single ASM_LINE token so the
             # compiler preserves the entire macro definition verbatim.
-            if line.lower().startswith('macro'):
-                # gather lines until a line that starts with 'endmacro' (case-insensitive)
-                j = i
-                block_lines = []
-                while j < total:
-                    block_line = self.lines[j]
+            if line[:5].lower() == 'macro':
+                # gather lines until a line that starts with 'endmacro' (case-insensitive);
+                # pulling them from the shared iterator skips past the block
+                block_lines = [original_line]
+                for _, block_line in lines:
                     block_lines.append(block_line)
-                    if block_line.strip().lower().startswith('endmacro'):
+                    if block_line.lstrip()[:8].lower() == 'endmacro':
                         break
-                    j += 1
                 # join with newline to preserve original formatting
                 block_text = '\n'.join(block_lines)
-                self.tokens.append(Token(TokenType.ASM_LINE, block_text, line_num))
-                # advance past the captured block
-                i = j + 1
+                append(Token(_TT_ASM_LINE, block_text, line_num))
                 continue
 
             # otherwise continue normal handling for single line
             
-            first_word = line.split()[0].lower() if line.split() else ''
+            first_word = line.split(None, 1)[0].lower()
 
             # Handle include directives specially (e.g. %include "file.asm" or include file.asm)
             if first_word in ('%include', 'include'):
@@ -74,163 +125,61 @@ class Lexer:
                     path = rest[1:-1]
                 else:
                     # take the first token (unquoted path)
-                    path = rest.split()[0] if rest.split() else rest
+                    parts = rest.split(None, 1)
+                    path = parts[0] if parts else rest
 
-                self.tokens.append(Token(TokenType.INCLUDE, path, line_num, 0))
+                append(Token(TokenType.INCLUDE, path, line_num, 0))
                 # preserve newline token for consistency
-                self.tokens.append(Token(TokenType.NEWLINE, '\n', line_num))
-                i += 1
+                append(Token(_TT_NEWLINE, '\n', line_num))
                 continue
 
-            if first_word in self.keywords:
+            if first_word in _KEYWORDS:
                 self.tokenize_line(line, line_num)
-                i += 1
             else:
-                self.tokens.append(Token(TokenType.ASM_LINE, original_line, line_num))
-                i += 1
+                append(Token(_TT_ASM_LINE, original_line, line_num))
         
-        self.tokens.append(Token(TokenType.EOF, None, len(self.lines) + 1))
+        append(Token(TokenType.EOF, None, len(self.lines) + 1))
         return self.tokens
     
     def tokenize_line(self, line, line_num):
-        i = 0
-        
-        while i < len(line):
-            if line[i].isspace():
-                i += 1
-                continue
-            
-            if line[i] == ';':
-                break
-            
-            # String literals (support both double and single quotes)
-            if line[i] in ('"', "'"):
-                quote_char = line[i]
-                j = i + 1
-                escaped = False
-                while j < len(line):
-                    if escaped:
-                        escaped = False
-                        j += 1
-                        continue
-                    if line[j] == '\\':
-                        escaped = True
-                        j += 1
-                        continue
-                    if line[j] == quote_char:
-                        break
-                    j += 1
-                
-                if j < len(line):
-                    string_val = line[i+1:j]
-                    string_val = string_val.replace('\\n', '\n').replace('\\t', '\t')
-                    string_val = string_val.replace('\\r', '\r').replace('\\"', '"')
-                    string_val = string_val.replace("\\'", "'")
-                    string_val = string_val.replace('\\\\', '\\')
-                    self.tokens.append(Token(TokenType.STRING, string_val, line_num, i))
-                    i = j + 1
-                else:
-                    raise SyntaxError(f"Line {line_num}: Unterminated string")
-                continue
-            
-            # Numbers (support optional leading '+' or '-' so '-1', '-0xFF'
-            # and '-0b101' are tokenized as single NUMBER tokens). We only
-            # treat a leading sign as part of the number when it's directly
-            # followed by digits or a base prefix (0x/0b).
-            sign = ''
-            if line[i] in '+-' and (i + 1) < len(line) and (line[i+1].isdigit() or (line[i+1] == '0' and i+2 < len(line) and line[i+2] in 'xXbB')):
-                sign = line[i]
-                i += 1
-
-            if line[i].isdigit() or (line[i] == '0' and i+1 < len(line) and line[i+1] in 'xXbB'):
-                j = i
-                if line[i] == '0' and i+1 < len(line):
-                    if line[i+1] in 'xX':
-                        j += 2
-                        while j < len(line) and line[j] in '0123456789abcdefABCDEF':
-                            j += 1
-                    elif line[i+1] in 'bB':
-                        j += 2
-                        while j < len(line) and line[j] in '01':
-                            j += 1
-                    else:
-                        while j < len(line) and line[j].isdigit():
-                            j += 1
-                else:
-                    while j < len(line) and line[j].isdigit():
-                        j += 1
-
-                numtext = sign + line[i:j]
-                # token start index is adjusted back if there was a sign
-                start_idx = i - len(sign) if sign else i
-                self.tokens.append(Token(TokenType.NUMBER, numtext, line_num, start_idx))
-                i = j
-                continue
-            
-            # Two-character operators
-            if i + 1 < len(line):
-                two_char = line[i:i+2]
-                token_type = None
-                
-                if two_char == '==':
-                    token_type = TokenType.EQ
-                elif two_char == '!=':
-                    token_type = TokenType.NE
-                elif two_char == '<=':
-                    token_type = TokenType.LE
-                elif two_char == '>=':
-                    token_type = TokenType.GE
-                
-                if token_type:
-                    self.tokens.append(Token(token_type, two_char, line_num, i))
-                    i += 2
-                    continue
-            
-            # Single-character operators
-            char_tokens = {
-                '<': TokenType.LT, '>': TokenType.GT,
-                '=': TokenType.ASSIGN, ',': TokenType.COMMA,
-                '(': TokenType.LPAREN, ')': TokenType.RPAREN,
-                '[': TokenType.LBRACKET, ']': TokenType.RBRACKET,
-                '+': TokenType.PLUS, '-': TokenType.MINUS,
-                '*': TokenType.ASTERISK, '/': TokenType.DIVIDE,
-                '%': TokenType.MODULO
-            }
-            
-            if line[i] in char_tokens:
-                self.tokens.append(Token(char_tokens[line[i]], line[i], line_num, i))
-                i += 1
-                continue
-            
-            # Identifiers and keywords
-            if line[i].isalpha() or line[i] == '_':
-                j = i
-                while j < len(line) and (line[j].isalnum() or line[j] == '_'):
-                    j += 1
-                
-                word = line[i:j]
+        append = self.tokens.append
+        for m in _TOKEN_RE.finditer(line):
+            kind = m.lastgroup
+            i = m.start()
+
+            if kind == 'IDENT':
+                # Names repeat throughout a program; interning makes every
+                # occurrence share one string and speeds later dict lookups
+                word = intern(m.group())
                 word_lower = word.lower()
                 
                 # Keywords
-                if word_lower in self.keywords:
-                    self.tokens.append(Token(self.keywords[word_lower], word_lower, line_num, i))
+                keyword = _KEYWORDS.get(word_lower)
+                if keyword is not None:
+                    append(Token(keyword, intern(word_lower), line_num, i))
+                elif word_lower in _REGISTER_WORDS:
+                    append(Token(_TT_REGISTER, word, line_num, i))
                 else:
-                    # Register names: accept base registers like 'r12' and
-                    # 32-bit subregister forms like 'r12d'. Many users will
-                    # write 'r12d' when they want the 32-bit subregister; the
-                    # lexer should treat these as registers so later codegen
-                    # can handle mapping correctly.
-                    if word_lower in self.registers:
-                        self.tokens.append(Token(TokenType.REGISTER, word, line_num, i))
-                    elif word_lower.endswith('d') and word_lower[:-1] in self.registers:
-                        # e.g. 'r12d' -> base 'r12' is a known register
-                        self.tokens.append(Token(TokenType.REGISTER, word, line_num, i))
-                    else:
-                        self.tokens.append(Token(TokenType.IDENTIFIER, word, line_num, i))
-                
-                i = j
-                continue
-            
-            i += 1
+                    append(Token(_TT_IDENTIFIER, word, line_num, i))
+
+            elif kind == 'OP':
+                op = m.group()
+                append(Token(_OPERATOR_TOKENS[op], op, line_num, i))
+
+            elif kind == 'NUMBER':
+                append(Token(_TT_NUMBER, m.group(), line_num, i))
+
+            elif kind == 'STRING':
+                string_val = m.group()[1:-1]
+                if '\\' in string_val:
+                    string_val = _ESCAPE_RE.sub(_unescape, string_val)
+                append(Token(_TT_STRING, string_val, line_num, i))
+
+            elif kind == 'COMMENT':
+                break
+
+            else:
+                # an opening quote that the STRING alternative could not close
+                raise SyntaxError(f"Line {line_num}: Unterminated string")
         
-        self.tokens.append(Token(TokenType.NEWLINE, '\n', line_num))
+        append(Token(_TT_NEWLINE, '\n', line_num))
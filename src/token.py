@@ -1,9 +1,7 @@
-from enum import Enum
-from dataclasses import dataclass
-from typing import Any
+from enum import IntEnum
 
 
-class TokenType(Enum):
+class TokenType(IntEnum):
     EOF = 0
     IF = 1
     ELIF = 2
@@ -48,9 +46,23 @@ class TokenType(Enum):
     ASTERISK = 41
 
 
-@dataclass
 class Token:
-    type: TokenType
-    value: Any
-    line: int
-    col: int = 0
+    # Plain slotted class rather than a dataclass: one is built per lexeme,
+    # and slots drop the per-instance __dict__.
+    __slots__ = ('type', 'value', 'line', 'col')
+
+    def __init__(self, type, value, line, col=0):
+        self.type = type
+        self.value = value
+        self.line = line
+        self.col = col
+
+    def __repr__(self):
+        return f"Token(type={self.type!r}, value={self.value!r}, line={self.line!r}, col={self.col!r})"
+
+    def __eq__(self, other):
+        if other.__class__ is not Token:
+            return NotImplemented
+        return (self.type, self.value, self.line, self.col) == (other.type, other.value, other.line, other.col)
+
+    __hash__ = None
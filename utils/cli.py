@@ -1,5 +1,4 @@
 import sys
-import time
 import threading
 import itertools
 
@@ -16,49 +15,93 @@ class Colors:
     GREY = '\033[90m'
     MAGENTA = '\033[35m'
 
+# Redirected output (log files, CI) gets plain text instead of escape codes,
+# and is line buffered so progress shows up as it happens rather than when
+# the block buffer fills or the process exits
+if not sys.stdout.isatty():
+    for _name in [n for n in vars(Colors) if n.isupper()]:
+        setattr(Colors, _name, '')
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=True)
+
+# Banner and usage text are rendered once at import and written in one call
+_BANNER = (
+    "\n"
+    f"  {Colors.BOLD}{Colors.MAGENTA}CASM{Colors.ENDC} {Colors.GREY}v2.0{Colors.ENDC}\n"
+    f"  {Colors.GREY}Advanced Assembly Compiler{Colors.ENDC}\n"
+    "\n"
+)
+
+_USAGE = (
+    f"{Colors.BOLD}Usage:{Colors.ENDC} {Colors.GREEN}casm{Colors.ENDC} {Colors.YELLOW}<input.asm>{Colors.ENDC} [options]\n"
+    "\n"
+    f"{Colors.BOLD}Options:{Colors.ENDC}\n"
+    f"  {Colors.GREEN}-o <file>{Colors.ENDC}      Specify output file\n"
+    f"  {Colors.GREEN}-e, --exe{Colors.ENDC}      Compile directly to .exe\n"
+    f"  {Colors.GREEN}--build{Colors.ENDC}        Assemble and link to executable\n"
+    f"  {Colors.GREEN}--target <t>{Colors.ENDC}   Target OS: windows, linux, macos\n"
+    f"  {Colors.GREEN}--arch <a>{Colors.ENDC}     Architecture: x86_64, arm64\n"
+    f"  {Colors.GREEN}--run{Colors.ENDC}          Run after building\n"
+    f"  {Colors.GREEN}--debug{Colors.ENDC}        Enable debug symbols\n"
+    f"  {Colors.GREEN}--ldflags <f>{Colors.ENDC}  Linker flags (quoted string)\n"
+    f"  {Colors.GREEN}-v, --verbose{Colors.ENDC}  Verbose output\n"
+    f"  {Colors.GREEN}-h, --help{Colors.ENDC}     Show help\n"
+    "\n"
+    f"{Colors.BOLD}Examples:{Colors.ENDC}\n"
+    f"  {Colors.CYAN}casm program.asm{Colors.ENDC}\n"
+    f"  {Colors.CYAN}casm program.asm --build{Colors.ENDC}\n"
+    f"  {Colors.CYAN}casm program.asm --exe --run{Colors.ENDC}\n"
+    f"  {Colors.CYAN}casm program.asm --build --target macos --arch arm64{Colors.ENDC}\n"
+    f"  {Colors.CYAN}casm program.asm -o output.asm -v{Colors.ENDC}\n"
+)
+
+# Status line prefixes, so each message is a single concatenation
+_ERROR_PREFIX = f"\r  {Colors.RED}✖{Colors.ENDC} "
+_WARNING_PREFIX = f"\r  {Colors.YELLOW}⚠{Colors.ENDC} "
+_SUCCESS_PREFIX = f"\r  {Colors.GREEN}✔{Colors.ENDC} "
+_INFO_PREFIX = f"\r  {Colors.BLUE}ℹ{Colors.ENDC} "
+_STEP_PREFIX = f"\r  {Colors.CYAN}→{Colors.ENDC} "
+
+# Switches that only turn config entries on, and the entries each sets.
+# --debug enables debug-friendly NASM output (DWARF/codeview info).
+_FLAG_OPTIONS = {
+    '-e': ('exe', 'build'), '--exe': ('exe', 'build'), '--e': ('exe', 'build'),
+    '--build': ('build',),
+    '--run': ('run', 'build'),
+    '--debug': ('debug',),
+    '-v': ('verbose',), '--verbose': ('verbose',),
+}
+
 class Spinner:
     def __init__(self, message="Processing...", delay=0.1):
         self.spinner = itertools.cycle(['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏'])
         self.delay = delay
-        self.busy = False
-        self.spinner_visible = False
+        # set by __exit__; also cuts short the wait between frames so
+        # leaving the context does not sit out the rest of a delay
+        self._done = threading.Event()
         self.message = message
         sys.stdout.write(f"{Colors.CYAN}  {message} {Colors.ENDC}")
         sys.stdout.flush()
 
-    def write_next(self):
-        with self._screen_lock:
-            if not self.spinner_visible:
-                sys.stdout.write(next(self.spinner))
-                self.spinner_visible = True
-                sys.stdout.flush()
-
-    def remove_spinner(self, cleanup=False):
-        with self._screen_lock:
-            if self.spinner_visible:
-                sys.stdout.write('\b')
-                self.spinner_visible = False
-                if cleanup:
-                    sys.stdout.write(' ')       # overwrite spinner with blank
-                    sys.stdout.write('\r')      # return to start of line, NOT \n
-                sys.stdout.flush()
-
     def spinner_task(self):
-        while self.busy:
-            self.write_next()
-            time.sleep(self.delay)
-            self.remove_spinner()
+        # This thread is the only one drawing frames and __exit__ joins it
+        # before touching the line, so no lock is needed; each tick is a
+        # single backspace + next frame write.
+        back = ''
+        while not self._done.is_set():
+            sys.stdout.write(back + next(self.spinner))
+            sys.stdout.flush()
+            back = '\b'
+            self._done.wait(self.delay)
 
     def __enter__(self):
-        self._screen_lock = threading.Lock()
-        self.busy = True
+        self._done.clear()
         self.thread = threading.Thread(target=self.spinner_task)
         self.thread.start()
         return self
 
     def __exit__(self, exception, value, tb):
-        self.busy = False
-        self.remove_spinner(cleanup=True)
+        self._done.set()
         self.thread.join()
         # Clear the line
         sys.stdout.write('\r' + ' ' * (len(self.message) + 10) + '\r')
@@ -69,53 +112,33 @@ class Spinner:
 class CLI:
     @staticmethod
     def print_banner():
-        print()
-        print(f"  {Colors.BOLD}{Colors.MAGENTA}CASM{Colors.ENDC} {Colors.GREY}v2.0{Colors.ENDC}")
-        print(f"  {Colors.GREY}Advanced Assembly Compiler{Colors.ENDC}")
-        print()
+        sys.stdout.write(_BANNER)
+        sys.stdout.flush()
     
     @staticmethod
     def print_usage():
-        print(f"{Colors.BOLD}Usage:{Colors.ENDC} {Colors.GREEN}casm{Colors.ENDC} {Colors.YELLOW}<input.asm>{Colors.ENDC} [options]")
-        print()
-        print(f"{Colors.BOLD}Options:{Colors.ENDC}")
-        print(f"  {Colors.GREEN}-o <file>{Colors.ENDC}      Specify output file")
-        print(f"  {Colors.GREEN}-e, --exe{Colors.ENDC}      Compile directly to .exe")
-        print(f"  {Colors.GREEN}--build{Colors.ENDC}        Assemble and link to executable")
-        print(f"  {Colors.GREEN}--target <t>{Colors.ENDC}   Target OS: windows, linux, macos")
-        print(f"  {Colors.GREEN}--arch <a>{Colors.ENDC}     Architecture: x86_64, arm64")
-        print(f"  {Colors.GREEN}--run{Colors.ENDC}          Run after building")
-        print(f"  {Colors.GREEN}--debug{Colors.ENDC}        Enable debug symbols")
-        print(f"  {Colors.GREEN}--ldflags <f>{Colors.ENDC}  Linker flags (quoted string)")
-        print(f"  {Colors.GREEN}-v, --verbose{Colors.ENDC}  Verbose output")
-        print(f"  {Colors.GREEN}-h, --help{Colors.ENDC}     Show help")
-        print()
-        print(f"{Colors.BOLD}Examples:{Colors.ENDC}")
-        print(f"  {Colors.CYAN}casm program.asm{Colors.ENDC}")
-        print(f"  {Colors.CYAN}casm program.asm --build{Colors.ENDC}")
-        print(f"  {Colors.CYAN}casm program.asm --exe --run{Colors.ENDC}")
-        print(f"  {Colors.CYAN}casm program.asm --build --target macos --arch arm64{Colors.ENDC}")
-        print(f"  {Colors.CYAN}casm program.asm -o output.asm -v{Colors.ENDC}")
+        sys.stdout.write(_USAGE)
+        sys.stdout.flush()
     
     @staticmethod
     def error(msg):
-        print(f"\r  {Colors.RED}✖{Colors.ENDC} {msg}")
+        print(_ERROR_PREFIX + str(msg))
 
     @staticmethod
     def warning(msg):
-        print(f"\r  {Colors.YELLOW}⚠{Colors.ENDC} {msg}")
+        print(_WARNING_PREFIX + str(msg))
 
     @staticmethod
     def success(msg):
-        print(f"\r  {Colors.GREEN}✔{Colors.ENDC} {msg}")
+        print(_SUCCESS_PREFIX + str(msg))
 
     @staticmethod
     def info(msg):
-        print(f"\r  {Colors.BLUE}ℹ{Colors.ENDC} {msg}")
+        print(_INFO_PREFIX + str(msg))
     
     @staticmethod
     def step(msg):
-        print(f"\r  {Colors.CYAN}→{Colors.ENDC} {msg}")
+        print(_STEP_PREFIX + str(msg))
 
     @staticmethod
     def spinner(message):
@@ -147,6 +170,12 @@ class CLI:
             if arg in ['-h', '--help']:
                 config['help'] = True
                 return config
+
+            flags = _FLAG_OPTIONS.get(arg)
+            if flags is not None:
+                for key in flags:
+                    config[key] = True
+                i += 1
             
             elif arg == '-o':
                 if i + 1 < len(args):
@@ -156,11 +185,6 @@ class CLI:
                     CLI.error("-o requires filename")
                     return None
             
-            elif arg in ['-e', '--exe', '--e']:
-                config['exe'] = True
-                config['build'] = True
-                i += 1
-
             elif arg == '--target':
                 if i + 1 < len(args):
                     requested = args[i + 1].lower()
@@ -194,24 +218,6 @@ class CLI:
                     CLI.error("--ldflags requires a quoted string of flags (e.g. '-L/path -lSDL2')")
                     return None
             
-            elif arg == '--build':
-                config['build'] = True
-                i += 1
-            
-            elif arg == '--run':
-                config['run'] = True
-                config['build'] = True
-                i += 1
-
-            elif arg == '--debug':
-                # Enable debug-friendly NASM output (emit DWARF/codeview info)
-                config['debug'] = True
-                i += 1
-            
-            elif arg in ['-v', '--verbose']:
-                config['verbose'] = True
-                i += 1
-            
             elif not arg.startswith('-'):
                 if config['input_file'] is None:
                     config['input_file'] = arg
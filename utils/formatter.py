@@ -14,6 +14,21 @@ from typing import List, Set
 import re
 import os
 
+# Generated .L<number> label, rewritten to %%L<number> inside macros
+_MACRO_LABEL_RE = re.compile(r"\.L(\d+)\b")
+
+# Section header prefix (lower-cased) -> bucket collect_sections routes into
+_SECTION_MAP = {'section .data': 'data', 'section .bss': 'bss', 'section .text': 'text'}
+
+# A `section .text` line (any indentation or case) in stdlib code
+_TEXT_HEADER_RE = re.compile(r'^[ \t]*section \.text', re.IGNORECASE | re.MULTILINE)
+
+# Zero-width match at the start of every line that ends with ':' (a label)
+_LABEL_LINE_RE = re.compile(r'(?m)^(?=[^\n]*:[ \t\r]*$)')
+
+# Source-level DSL keywords that must not survive into the merged text
+_DSL_DIRECTIVES = frozenset({'if', 'elif', 'else', 'endif', 'for', 'endfor', 'while', 'endwhile', 'func', 'endfunc'})
+
 
 def strip_comments(lines: List[str]) -> List[str]:
     out = []
@@ -37,85 +52,138 @@ def strip_comments(lines: List[str]) -> List[str]:
 
 def collect_sections(original: str):
     """Parse the original file into preamble, data_lines, bss_lines, externs and text_lines.
-    Returns a dict with those keys (lists/sets).
+    Returns a dict with those keys (lists/sets), plus 'labels': the set of
+    names of every `name:` line in the file.
     """
     preamble = []
     data_lines = []
     bss_lines = []
     externs = []
     text_lines = []
+    labels = set()
+
+    # bound methods, looked up once rather than per line
+    add_label = labels.add
+    add_preamble = preamble.append
+    add_data = data_lines.append
+    add_bss = bss_lines.append
+    add_text = text_lines.append
 
     cur = None
     seen_section = False
     for ln in original.splitlines():
         s = ln.strip()
-        ls = s.lower()
-        if ls.startswith('section .data'):
-            cur = 'data'
-            seen_section = True
-            continue
-        if ls.startswith('section .bss'):
-            cur = 'bss'
-            seen_section = True
-            continue
-        if ls.startswith('section .text'):
-            cur = 'text'
-            seen_section = True
-            continue
+        if s.endswith(':'):
+            add_label(s[:-1])
+        # Section and extern headers are the only lines inspected here;
+        # lower-case just the prefix those checks need, and only when the
+        # line can start one. '.bss' is a character shorter than the other
+        # section names, hence the second lookup.
+        if s and s[0] in 'sSeE':
+            ls = s[:13].lower()
+            section = _SECTION_MAP.get(ls) or _SECTION_MAP.get(ls[:12])
+            if section:
+                cur = section
+                seen_section = True
+                continue
 
-        if ls.startswith('extern '):
-            # record extern (keep original spacing)
-            externs.append(s[len('extern '):].strip())
-            continue
+            if ls.startswith('extern '):
+                # record extern (keep original spacing)
+                externs.append(s[len('extern '):].strip())
+                continue
 
         if not seen_section:
-            preamble.append(ln)
+            add_preamble(ln)
             continue
 
         # After seeing any section, route lines based on cur
         if cur == 'data':
             if s:
-                data_lines.append(ln)
+                add_data(ln)
         elif cur == 'bss':
             if s:
-                bss_lines.append(ln)
+                add_bss(ln)
         else:
-            text_lines.append(ln)
+            add_text(ln)
 
     return {
         'preamble': preamble,
         'data': data_lines,
         'bss': bss_lines,
         'externs': externs,
-        'text': text_lines
+        'text': text_lines,
+        'labels': labels
     }
 
 
-def merge_unique(existing: List[str], additions: List[str]) -> List[str]:
-    seen = set(l.strip() for l in existing)
+def merge_unique(existing: List[str], additions: List[str], seen: Set[str] = None) -> List[str]:
+    """Append additions not already present (compared stripped) to a copy of existing.
+
+    `seen` may carry the stripped lines of `existing` across calls; it is
+    updated in place so merging into the same list again skips the rebuild.
+    """
+    if seen is None:
+        seen = set(l.strip() for l in existing)
     out = existing.copy()
     for a in additions:
         if not a:
             continue
-        if a.strip() not in seen:
+        key = a.strip()
+        if key not in seen:
             out.append(a)
-            seen.add(a.strip())
+            seen.add(key)
     return out
 
 
 def split_functions(code: str):
     """Split stdlib code blob into function chunks using label lines ending with ':' as separators."""
-    funcs = []
-    cur = []
-    for ln in code.splitlines():
-        if ln.strip().endswith(':') and cur:
-            funcs.append('\n'.join(cur).rstrip())
-            cur = [ln]
-        else:
-            cur.append(ln)
-    if cur:
-        funcs.append('\n'.join(cur).rstrip())
-    return funcs
+    return [c.rstrip() for c in _LABEL_LINE_RE.split(code) if c.strip()]
+
+
+def clean_text(lines: List[str], drop_directives: bool = False):
+    """Prepare preamble/text lines for output in a single pass.
+
+    - Inside assembler macro blocks ("%macro"/"macro" ... "%endmacro"/
+      "endmacro", matched case-insensitively), generated dot-prefixed labels
+      (.L0) become NASM macro-local labels (%%L0), so labels do not collide
+      across expansions of a macro holding generated assembly.
+    - With `drop_directives`, source-level DSL directive lines (if/while/
+      for/etc.) outside macros are removed; left in the merged assembly they
+      would be invalid NASM.
+    - Comments are stripped and empty lines dropped, as in strip_comments.
+
+    Returns the cleaned lines and whether any line survived the directive
+    filter (comment-only lines included).
+    """
+    out = []
+    kept = False
+    in_macro = False
+    for ln in lines:
+        s = ln.strip()
+        low = s.lower()
+        if low.startswith('%macro') or low.startswith('macro'):
+            in_macro = True
+        elif low.startswith('%endmacro') or low.startswith('endmacro'):
+            in_macro = False
+        elif in_macro:
+            # Use word-boundary to avoid accidental mid-token replacements.
+            # Most lines have no label at all, so look for the literal first.
+            if '.L' in ln:
+                ln = _MACRO_LABEL_RE.sub(r"%%L\1", ln)
+        elif drop_directives and s and s.split(None, 1)[0].lower() in _DSL_DIRECTIVES:
+            continue
+        kept = True
+
+        # same comment handling as strip_comments
+        if '`' in ln and ';' in ln and ln.find('`') < ln.find(';'):
+            out.append(ln.rstrip())
+            continue
+        if ';' in ln:
+            ln = ln.split(';', 1)[0]
+        ln = ln.rstrip()
+        if ln:
+            out.append(ln)
+    return out, kept
 
 
 def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: dict, deps: dict, data_section: List[str], arch: str = 'x86_64') -> str:
@@ -129,62 +197,30 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
     """
     parts = collect_sections(original)
 
-    # Convert generated dot-prefixed labels (e.g. .L0) to NASM macro-local
-    # labels (%%L0) when they appear inside assembler macro blocks. This
-    # ensures that when generated assembly is inserted into a `%macro` /
-    # `macro` definition, labels are local to each macro expansion and do
-    # not collide across expansions.
-    def _convert_labels_in_macros(lines: list) -> list:
-        out = []
-        in_macro = False
-        for ln in lines:
-            s = ln.strip()
-            low = s.lower()
-            if low.startswith('%macro') or low.startswith('macro'):
-                in_macro = True
-                out.append(ln)
-                continue
-            if low.startswith('%endmacro') or low.startswith('endmacro'):
-                in_macro = False
-                out.append(ln)
-                continue
-
-            if in_macro:
-                # Replace occurrences of .L<number> (labels and references)
-                # with NASM macro-local %%L<number>. Use word-boundary to
-                # avoid accidental mid-token replacements.
-                ln = re.sub(r"\.L(\d+)\b", r"%%L\1", ln)
-            out.append(ln)
-        return out
-
-    # Convert labels in both preamble and text regions since macros may
-    # appear before any explicit `section .text` header (they're then
-    # collected into the preamble by `collect_sections`).
-    parts['text'] = _convert_labels_in_macros(parts['text'])
-    parts['preamble'] = _convert_labels_in_macros(parts['preamble'])
-
-    # Strip comments from preamble and text (but keep generated blocks content intact)
-    preamble = strip_comments(parts['preamble'])
-    text = parts['text']
-    # We will later replace text ranges with generated blocks using gen_blocks
+    # Clean preamble and text in one pass each (macros may appear before
+    # any explicit `section .text` header, in which case `collect_sections`
+    # puts them in the preamble). DSL directive lines only need dropping
+    # from the text when generated blocks were spliced into it.
+    preamble, _ = clean_text(parts['preamble'])
+    text, has_text = clean_text(parts['text'], drop_directives=bool(gen_blocks))
 
     # Merge externs
     existing_externs = set(parts['externs'])
     for e in deps.get('externs', set()):
         existing_externs.add(e)
 
-    # Merge data and bss (unique)
-    merged_data = merge_unique(parts['data'], deps.get('data', []))
-    merged_data = merge_unique(merged_data, data_section or [])
+    # Merge data and bss (unique). Only the user's lines can carry
+    # comments; stdlib and codegen lines are clean, so they are appended as
+    # they are instead of going through strip_comments again (which would
+    # also cut a ';' inside an ARM64 .asciz string).
+    data_seen = set(l.strip() for l in parts['data'])
+    merged_data = merge_unique(strip_comments(parts['data']), deps.get('data', []) + (data_section or []), data_seen)
 
-    merged_bss = merge_unique(parts['bss'], deps.get('bss', []))
+    bss_seen = set(l.strip() for l in parts['bss'])
+    merged_bss = merge_unique(strip_comments(parts['bss']), deps.get('bss', []), bss_seen)
 
-    # Determine existing function labels in original to avoid duplicates
-    existing_labels = set()
-    for ln in original.splitlines():
-        s = ln.strip()
-        if s.endswith(':'):
-            existing_labels.add(s[:-1])
+    # Existing function labels in original, to avoid duplicates
+    existing_labels = parts['labels']
 
     # Split deps['code'] into function chunks and include only those not present
     stdlib_code = deps.get('code', '') or ''
@@ -192,7 +228,7 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
     if stdlib_code:
         for fn_chunk in split_functions(stdlib_code):
             # get first label
-            first_line = fn_chunk.splitlines()[0].strip()
+            first_line = fn_chunk.partition('\n')[0].strip()
             label = first_line[:-1] if first_line.endswith(':') else None
             if label and label in existing_labels:
                 continue
@@ -253,11 +289,9 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
 
     # externs
     if existing_externs:
-        for e in sorted(existing_externs):
-            if arch == 'arm64':
-                out_lines.append(f'.extern _{e}')
-            else:
-                out_lines.append(f'extern {e}')
+        # one joined block instead of a formatted line per name
+        prefix = '.extern _' if arch == 'arm64' else 'extern '
+        out_lines.append(prefix + ('\n' + prefix).join(sorted(existing_externs)))
         out_lines.append('')
 
     # data
@@ -266,7 +300,7 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
             out_lines.append('.data')
         else:
             out_lines.append('section .data')
-        out_lines.extend(strip_comments(merged_data))
+        out_lines.extend(merged_data)
         out_lines.append('')
 
     # bss
@@ -275,7 +309,7 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
             out_lines.append('.bss')
         else:
             out_lines.append('section .bss')
-        out_lines.extend(strip_comments(merged_bss))
+        out_lines.extend(merged_bss)
         out_lines.append('')
 
     # inline generated blocks into text
@@ -301,76 +335,19 @@ def format_and_merge(original: str, generated_helpers: List[str], gen_blocks: di
     else:
         generated_helpers = []
 
-    if not has_text_header:
-        for ln in deps.get('code', '').splitlines():
-            if ln.strip().lower().startswith('section .text'):
-                has_text_header = True
-                break
-
-    def remove_highlevel_directives(lines: List[str]) -> List[str]:
-        """Remove source-level DSL directive lines (if/while/for/etc.) from text.
-
-        This prevents high-level statements from being left in the merged
-        assembly (which would be invalid NASM). We only remove lines that
-        start with a recognized keyword (ignoring leading whitespace).
-        """
-        directives = {'if', 'elif', 'else', 'endif', 'for', 'endfor', 'while', 'endwhile', 'func', 'endfunc'}
-        out = []
-        in_macro = False
-        for ln in lines:
-            s = ln.strip()
-
-            # Detect entry/exit of assembler macro blocks and preserve
-            # everything inside them. Macro directives may be written as
-            # "%macro" / "%endmacro" (NASM) or simply "macro" / "endmacro"
-            # depending on author style. We use a case-insensitive prefix
-            # check to avoid stripping DSL lines that are part of macros.
-            low = s.lower()
-            if low.startswith('%macro') or low.startswith('macro'):
-                in_macro = True
-                out.append(ln)
-                continue
-            if low.startswith('%endmacro') or low.startswith('endmacro'):
-                in_macro = False
-                out.append(ln)
-                continue
+    if not has_text_header and _TEXT_HEADER_RE.search(stdlib_code):
+        has_text_header = True
 
-            if in_macro:
-                # preserve macro body lines verbatim
-                out.append(ln)
-                continue
-
-            if not s:
-                out.append(ln)
-                continue
-
-            first = s.split()[0].lower()
-            if first in directives:
-                # skip DSL directive lines that are not inside macros
-                continue
-            out.append(ln)
-        return out
-
-    if gen_blocks:
-        orig_lines = remove_highlevel_directives(parts['text'])
-        # Always ensure a text section header appears immediately before the
-        # text block (unless a dependency already declared one). We removed
-        # any stray header from generated_helpers above so we won't duplicate.
-        if not has_text_header and orig_lines:
-            if arch == 'arm64':
-                out_lines.append('.text')
-            else:
-                out_lines.append('section .text')
-        out_lines.extend(strip_comments(orig_lines))
-        out_lines.append('')
-    else:
-        if not has_text_header and text:
-            if arch == 'arm64':
-                out_lines.append('.text')
-            else:
-                out_lines.append('section .text')
-        out_lines.extend(strip_comments(text))
-        out_lines.append('')
+    # Always ensure a text section header appears immediately before the
+    # text block (unless a dependency already declared one). We removed
+    # any stray header from generated_helpers above so we won't duplicate.
+    if not has_text_header and has_text:
+        if arch == 'arm64':
+            out_lines.append('.text')
+        else:
+            out_lines.append('section .text')
+    out_lines.extend(text)
+    out_lines.append('')
 
     # append any other generated helpers (code_lines not part of blocks)
     if generated_helpers:
@@ -8,79 +8,68 @@ from src.c_asm_converter import CAsmConverter
 import os
 import re
 import pathlib
+import traceback
+from functools import cached_property
+
+
+# Source-map markers emitted by the code generator around each block:
+#   ; __GEN_START__ <id> <start_line>  /  ; __GEN_END__ <id> <end_line>
+# matched as a whole line of the generated code, so one scan over the text
+# finds every marker and its extent
+_GEN_MARKER_LINE_RE = re.compile(
+    r'^[^\S\n]*; __GEN_(START|END)__(?:[^\S\n]+(\S+))?(?:[^\S\n]+(-?\d+)(?!\S))?.*\n?',
+    re.MULTILINE)
+
+# Tokens SyntaxChecker acts on, as (role, name): block keywords that open or
+# close a construct, the branch keywords that need an enclosing 'if', and
+# EOF. Every other token misses this table with a single lookup.
+_STRUCTURE_TOKENS = {
+    TokenType.IF: ('open', 'if'), TokenType.FOR: ('open', 'for'),
+    TokenType.WHILE: ('open', 'while'), TokenType.FUNC: ('open', 'func'),
+    TokenType.ENDIF: ('close', 'if'), TokenType.ENDFOR: ('close', 'for'),
+    TokenType.ENDWHILE: ('close', 'while'), TokenType.ENDFUNC: ('close', 'func'),
+    TokenType.ELIF: ('branch', 'elif'), TokenType.ELSE: ('branch', 'else'),
+    TokenType.EOF: ('eof', None),
+}
 
 
 class SyntaxChecker:
     def __init__(self, tokens):
         self.tokens = tokens
-        self.pos = 0
         self.errors = []
 
     def check(self):
         self.check_structure()
         return self.errors
 
-    def current_token(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
-
-    def advance(self):
-        self.pos += 1
-
     def add_error(self, message, token=None):
-        if token:
+        if token is not None:
             self.errors.append(f"Line {token.line}: {message}")
         else:
-            current = self.current_token()
-            if current:
-                self.errors.append(f"Line {current.line}: {message}")
-            else:
-                self.errors.append(message)
+            self.errors.append(message)
 
     def check_structure(self):
         stack = []
+        lookup = _STRUCTURE_TOKENS.get
 
-        while self.pos < len(self.tokens):
-            token = self.current_token()
-
-            if token.type == TokenType.EOF:
-                break
+        for token in self.tokens:
+            entry = lookup(token.type)
+            if entry is None:
+                continue
 
-            if token.type == TokenType.IF:
-                stack.append(('if', token.line))
-            elif token.type == TokenType.FOR:
-                stack.append(('for', token.line))
-            elif token.type == TokenType.WHILE:
-                stack.append(('while', token.line))
-            elif token.type == TokenType.FUNC:
-                stack.append(('func', token.line))
-            elif token.type == TokenType.ELIF:
-                if not stack or stack[-1][0] != 'if':
-                    self.add_error("'elif' without matching 'if'", token)
-            elif token.type == TokenType.ELSE:
-                if not stack or stack[-1][0] != 'if':
-                    self.add_error("'else' without matching 'if'", token)
-            elif token.type == TokenType.ENDIF:
-                if not stack or stack[-1][0] != 'if':
-                    self.add_error("'endif' without matching 'if'", token)
+            role, kind = entry
+            if role == 'open':
+                stack.append((kind, token.line))
+            elif role == 'close':
+                if not stack or stack[-1][0] != kind:
+                    self.add_error(f"'end{kind}' without matching '{kind}'", token)
                 else:
                     stack.pop()
-            elif token.type == TokenType.ENDFOR:
-                if not stack or stack[-1][0] != 'for':
-                    self.add_error("'endfor' without matching 'for'", token)
-                else:
-                    stack.pop()
-            elif token.type == TokenType.ENDWHILE:
-                if not stack or stack[-1][0] != 'while':
-                    self.add_error("'endwhile' without matching 'while'", token)
-                else:
-                    stack.pop()
-            elif token.type == TokenType.ENDFUNC:
-                if not stack or stack[-1][0] != 'func':
-                    self.add_error("'endfunc' without matching 'func'", token)
-                else:
-                    stack.pop()
-
-            self.advance()
+            elif role == 'branch':
+                if not stack or stack[-1][0] != 'if':
+                    self.add_error(f"'{kind}' without matching 'if'", token)
+            else:
+                break
 
         for struct_type, line in stack:
             self.errors.append(f"Line {line}: Unclosed '{struct_type}' statement")
@@ -113,11 +102,17 @@ class Compiler:
         self.verbose = verbose
         self.target = kwargs.get('target', 'windows')
         self.arch = kwargs.get('arch', 'x86_64')
-        self.stdlib = StandardLibrary(target=self.target, arch=self.arch)
 
-    def log(self, message):
+    @cached_property
+    def stdlib(self):
+        # Built on first use: C conversions, failed compiles and programs
+        # that use no stdlib helpers never need the function tables.
+        return StandardLibrary(target=self.target, arch=self.arch)
+
+    def log(self, message, *args):
+        # %-style args are only formatted when the message is shown
         if self.verbose:
-            CLI.info(message)
+            CLI.info(message % args if args else message)
 
     def compile(self, _included=None):
         if self.input_file.lower().endswith('.c'):
@@ -131,12 +126,11 @@ class Compiler:
                 with open(self.output_file, 'w', encoding='utf-8') as f:
                     f.write(output)
                 
-                self.log(f"C conversion successful: {self.output_file}")
+                self.log("C conversion successful: %s", self.output_file)
                 CLI.success(f"Converted {os.path.basename(self.input_file)}")
                 return True
             except Exception as e:
                 CLI.error(f"C conversion error: {e}")
-                import traceback
                 traceback.print_exc()
                 return False
 
@@ -211,7 +205,7 @@ class Compiler:
             try:
                 lexer = Lexer(source)
                 tokens = lexer.tokenize()
-                self.log(f"    Generated {len(tokens)} tokens")
+                self.log("    Generated %d tokens", len(tokens))
             except SyntaxError as e:
                 CLI.error(f"Lexer error: {e}")
                 return False
@@ -239,17 +233,17 @@ class Compiler:
             try:
                 codegen = CodeGenerator(tokens, target=self.target, arch=self.arch)
                 generated_code, data_section, stdlib_used = codegen.generate()
-                self.log(f"    Generated {len(generated_code.split(chr(10)))} lines")
-                self.log(f"    Using stdlib functions: {', '.join(stdlib_used) if stdlib_used else 'none'}")
+                if self.verbose:
+                    self.log("    Generated %d lines", generated_code.count(chr(10)) + 1)
+                    self.log("    Using stdlib functions: %s", ', '.join(stdlib_used) if stdlib_used else 'none')
             except Exception as e:
                 CLI.error(f"Code generation error: {e}")
-                import traceback
                 traceback.print_exc()
                 return False
 
             self.log("Building final assembly file...")
             try:
-                output = self.build_assembly(generated_code, data_section, stdlib_used)
+                output = self.build_assembly(source, generated_code, data_section, stdlib_used)
             except Exception as e:
                 CLI.error(f"Assembly building error: {e}")
                 return False
@@ -257,7 +251,7 @@ class Compiler:
             try:
                 with open(self.output_file, 'w', encoding='utf-8') as f:
                     f.write(output)
-                self.log(f"Compilation successful: {self.output_file}")
+                self.log("Compilation successful: %s", self.output_file)
             except Exception as e:
                 CLI.error(f"Error writing output file: {e}")
                 return False
@@ -265,13 +259,10 @@ class Compiler:
         CLI.success(f"Compiled {os.path.basename(self.input_file)}")
         return True
 
-    def build_assembly(self, code_lines, data_section, stdlib_used):
-        # Read the original input file and keep it intact as the base of the output.
-        try:
-            with open(self.input_file, 'r', encoding='utf-8') as f:
-                original = f.read()
-        except Exception:
-            original = ''
+    def build_assembly(self, source, code_lines, data_section, stdlib_used):
+        # The original input (as already read by compile) is kept intact as
+        # the base of the output.
+        original = source
 
         # If this file already contains a previous compiler-generated block,
         # strip that block to avoid repeatedly appending generated content.
@@ -288,52 +279,54 @@ class Compiler:
         #   ; __GEN_END__ <id> <end_line>
         gen_blocks = {}
         other_gen_lines = []
-        if code_lines:
+        if code_lines and '; __GEN_' not in code_lines:
+            # No markers at all (e.g. plain assembly input): everything the
+            # generator produced is helper code, no block parsing needed.
+            other_gen_lines = code_lines.splitlines()
+        elif code_lines:
             # Support nested generated blocks by using a stack. Each stack
             # frame holds the block id, start line and collected lines.
             stack = []
-            for ln in code_lines.splitlines():
-                s = ln.strip()
-                if s.startswith('; __GEN_START__'):
-                    parts = s.split()
-                    bid = parts[2] if len(parts) >= 3 else None
-                    try:
-                        bstart = int(parts[3]) if len(parts) > 3 else None
-                    except Exception:
-                        bstart = None
-                    # push a new frame
-                    stack.append({'id': bid, 'start': bstart, 'lines': []})
-                    continue
+            pos = 0
+            for m in _GEN_MARKER_LINE_RE.finditer(code_lines):
+                # lines between the previous marker and this one go to the
+                # current (top) block, or to the non-block output
+                between = code_lines[pos:m.start()].splitlines()
+                pos = m.end()
+                if stack:
+                    stack[-1]['lines'].extend(between)
+                else:
+                    other_gen_lines.extend(between)
 
-                if s.startswith('; __GEN_END__'):
-                    parts = s.split()
-                    end_id = parts[2] if len(parts) >= 3 else None
-                    try:
-                        bend = int(parts[3]) if len(parts) > 3 else None
-                    except Exception:
-                        bend = None
-                    if stack:
-                        frame = stack.pop()
-                        # If this frame was nested inside another, merge its
-                        # collected lines into the parent so the outer block
-                        # replacement contains the inner content. Otherwise
-                        # record it as a top-level generated block.
-                        if stack:
-                            # merge into parent's lines
-                            stack[-1]['lines'].extend(frame['lines'])
-                        else:
-                            gen_blocks[frame['start']] = {
-                                'start': frame['start'],
-                                'end': bend,
-                                'lines': frame['lines'].copy()
-                            }
+                kind, bid, num = m.groups()
+                bline = int(num) if num is not None else None
+                if kind == 'START':
+                    # push a new frame
+                    stack.append({'id': bid, 'start': bline, 'lines': []})
                     continue
 
+                bend = bline
                 if stack:
-                    # append into the current (top) block
-                    stack[-1]['lines'].append(ln)
-                else:
-                    other_gen_lines.append(ln)
+                    frame = stack.pop()
+                    # If this frame was nested inside another, merge its
+                    # collected lines into the parent so the outer block
+                    # replacement contains the inner content. Otherwise
+                    # record it as a top-level generated block.
+                    if stack:
+                        # merge into parent's lines
+                        stack[-1]['lines'].extend(frame['lines'])
+                    else:
+                        gen_blocks[frame['start']] = {
+                            'start': frame['start'],
+                            'end': bend,
+                            'lines': frame['lines']
+                        }
+
+            tail = code_lines[pos:].splitlines()
+            if stack:
+                stack[-1]['lines'].extend(tail)
+            else:
+                other_gen_lines.extend(tail)
 
         # If we found generated blocks, replace the corresponding source
         # line ranges in the original file with the generated assembly.
@@ -341,21 +334,23 @@ class Compiler:
         if gen_blocks and original:
             orig_lines = original.splitlines()
             new_lines = []
+            # Walk the blocks in source order, copying the original lines
+            # between them as slices. `i` is the next (1-based) original
+            # line to copy; a block starting inside a range already
+            # replaced is ignored.
             i = 1
             max_i = len(orig_lines)
-            # create quick lookup by start line
-            starts = {k: v for k, v in gen_blocks.items() if k}
-            while i <= max_i:
-                if i in starts:
-                    blk = starts[i]
-                    # append generated assembly for that block
-                    new_lines.extend(blk['lines'])
-                    # skip original lines up to end (if end provided)
-                    end_line = blk.get('end') or i
-                    i = end_line + 1
-                else:
-                    new_lines.append(orig_lines[i-1])
-                    i += 1
+            for start, blk in sorted((k, v) for k, v in gen_blocks.items() if k):
+                if start > max_i:
+                    break
+                if start < i:
+                    continue
+                new_lines.extend(orig_lines[i-1:start-1])
+                # append generated assembly for that block
+                new_lines.extend(blk['lines'])
+                # skip original lines up to end (if end provided)
+                i = max(blk.get('end') or start, start) + 1
+            new_lines.extend(orig_lines[i-1:])
             processed_original = '\n'.join(new_lines).rstrip()
 
         # Rewrite any include directives in the original to point to the
@@ -412,7 +407,10 @@ class Compiler:
             combined_used.update(n.lower() for n in stdlib_used)
 
         # Use formatter to produce final merged content
-        deps = self.stdlib.get_dependencies(combined_used)
+        if combined_used:
+            deps = self.stdlib.get_dependencies(combined_used)
+        else:
+            deps = {'code': '', 'data': [], 'bss': [], 'externs': set()}
 
         final = format_and_merge(processed_original, other_gen_lines, gen_blocks, deps, data_section, arch=self.arch)
         return final